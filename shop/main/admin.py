@@ -1,14 +1,52 @@
-from django.forms import ModelChoiceField, ModelForm, ValidationError
+from django.forms import ModelForm
 from django.utils.safestring import mark_safe
 from django.contrib import admin
-from PIL import Image
 
 from .models import *
 
 
+class ProductAdminForm(ModelForm):
+
+    class Meta:
+        model = Product
+        fields = '__all__'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['image'].help_text = mark_safe(
+            '<span style="color:red; font-size:14px;">Upload an image with minimum resolution {}x{}</span>'.format(
+                *Product.MIN_RESOLUTION
+            )
+        )
+
+
+class ProductAdmin(admin.ModelAdmin):
+
+    form = ProductAdminForm
+
+
+class OrderItemInline(admin.TabularInline):
+
+    model = OrderItem
+    fields = readonly_fields = ('product', 'title', 'unit_price', 'qty', 'line_total')
+    can_delete = False
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class OrderAdmin(admin.ModelAdmin):
+
+    list_display = ('id', 'customer', 'status', 'total_products', 'total', 'created_at')
+    list_select_related = ('customer__user',)
+    inlines = [OrderItemInline]
+
+
 admin.site.register(Category)
 admin.site.register(Customer)
 admin.site.register(Cart)
 admin.site.register(CartProduct)
-admin.site.register(Order)
-admin.site.register(Product)
+admin.site.register(Order, OrderAdmin)
+admin.site.register(Product, ProductAdmin)
+admin.site.register(Job)
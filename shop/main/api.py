@@ -0,0 +1,203 @@
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.utils.http import quote_etag
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.generic import View
+
+from .forms import CatalogFilterForm
+from .mixins import CartMixin
+from .models import CartProduct, Product
+from .page_cache import get_catalog_version
+from .pagination import KeysetPaginator
+from .product_cache import get_product
+from .sidebar import get_sidebar_categories
+from .utils import (
+    CartOperationError, add_cart_product, apply_cart_operations, cart_operation, change_cart_product_qty,
+    remove_cart_product
+)
+
+
+PRODUCT_LIST_FIELDS = ('id', 'slug', 'title', 'price', 'image', 'created_at', 'category__slug')
+PRODUCT_DETAIL_FIELDS = PRODUCT_LIST_FIELDS + ('description', 'category__name')
+API_PAGE_SIZE = 24
+API_MAX_PAGE_SIZE = 100
+
+
+def dumps(value):
+    return json.dumps(value, cls=DjangoJSONEncoder, separators=(',', ':'))
+
+
+def error_response(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+def product_json(row):
+    """Public shape of a product from a values() row; no model instance is built."""
+    storage = Product._meta.get_field('image').storage
+    data = {
+        'id': row['id'],
+        'slug': row['slug'],
+        'title': row['title'],
+        'price': row['price'],
+        'image': storage.url(row['image']) if row['image'] else None,
+        'category': row['category__slug'],
+        'created_at': row['created_at'],
+    }
+    if 'description' in row:
+        data['description'] = row['description'] or ''
+        data['category_name'] = row['category__name']
+    return data
+
+
+def cart_json(cart):
+    items = []
+    if cart.pk is not None:
+        lines = CartProduct.objects.filter(cart=cart).order_by('id').values(
+            'product__slug', 'product__title', 'product__price', 'qty', 'total_price'
+        )
+        items = [
+            {
+                'slug': line['product__slug'], 'title': line['product__title'], 'price': line['product__price'],
+                'qty': line['qty'], 'total_price': line['total_price'],
+            }
+            for line in lines
+        ]
+    return {'total_products': cart.total_products, 'final_price': cart.final_price, 'items': items}
+
+
+class CatalogAPIView(View):
+    """
+    Catalog reads are keyed by the catalog version, so a conditional GET is
+    answered with 304 before any query, and the ETag changes with every
+    Product/Category write.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        digest = hashlib.md5(f'{get_catalog_version()}:{request.get_full_path()}'.encode()).hexdigest()
+        etag = quote_etag(digest)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+        return response
+
+
+class CategoryListAPIView(CatalogAPIView):
+
+    def get(self, request, *args, **kwargs):
+        categories = [
+            {'name': category['name'], 'slug': category['slug'], 'count': category['count']}
+            for category in get_sidebar_categories()
+        ]
+        return JsonResponse({'results': categories})
+
+
+class ProductListAPIView(CatalogAPIView):
+
+    def get(self, request, *args, **kwargs):
+        filter_form = CatalogFilterForm(request.GET)
+        products = Product.objects.all()
+        if request.GET.get('category'):
+            products = products.filter(category__slug=request.GET['category'])
+        try:
+            limit = min(max(int(request.GET.get('limit', API_PAGE_SIZE)), 1), API_MAX_PAGE_SIZE)
+        except ValueError:
+            limit = API_PAGE_SIZE
+        paginator = KeysetPaginator(
+            filter_form.filter_queryset(products).values(*PRODUCT_LIST_FIELDS), limit, filter_form.get_ordering()
+        )
+        page = paginator.page_from_request(request)
+        return StreamingHttpResponse(self.stream(page), content_type='application/json')
+
+    @staticmethod
+    def stream(page):
+        yield '{"results":['
+        for i, row in enumerate(page):
+            yield (',' if i else '') + dumps(product_json(row))
+        yield f'],"next":{dumps(page.next_cursor)},"previous":{dumps(page.previous_cursor)}}}'
+
+
+class ProductDetailAPIView(CatalogAPIView):
+
+    def get(self, request, *args, **kwargs):
+        row = Product.objects.filter(slug=kwargs.get('slug')).values(*PRODUCT_DETAIL_FIELDS).first()
+        if row is None:
+            return error_response('Product not found', 404)
+        return JsonResponse(product_json(row), encoder=DjangoJSONEncoder)
+
+
+@method_decorator(ensure_csrf_cookie, name='dispatch')
+class CartAPIView(CartMixin, View):
+    """
+    The visitor's cart; POSTs mirror AddToCartView, DeleteFromCartView and
+    ChangeQTYView, or apply a list of ``{"op", "slug", "qty"}`` operations
+    in one transaction (``batch``), and answer with the updated cart.
+    Writes need the CSRF token from the cookie this view sets.
+    """
+
+    http_method_names = ['get', 'post']
+    actions = ('add', 'remove', 'qty')
+
+    def get(self, request, *args, **kwargs):
+        return self.cart_response()
+
+    def post(self, request, *args, **kwargs):
+        action = kwargs.get('action')
+        if action == 'batch':
+            return self.batch(request)
+        if action not in self.actions:
+            return error_response('Unknown cart action', 404)
+        product = get_product(kwargs.get('slug'))
+        if product is None:
+            return error_response('Product not found', 404)
+        if action != 'add' and self.cart.pk is None:
+            return error_response('Product is not in the cart', 404)
+        try:
+            if action == 'add':
+                add_cart_product(self.get_or_create_cart(), product)
+            elif action == 'remove':
+                remove_cart_product(self.cart, product)
+            else:
+                _, _, qty = cart_operation('qty', product.slug, self.payload(request).get('qty'))
+                change_cart_product_qty(self.cart, product, qty)
+        except CartProduct.DoesNotExist:
+            return error_response('Product is not in the cart', 404)
+        except CartOperationError as e:
+            return error_response(str(e), 400)
+        return self.cart_response()
+
+    def batch(self, request):
+        operations = self.payload(request).get('operations')
+        if not isinstance(operations, list) or not all(isinstance(operation, dict) for operation in operations):
+            return error_response('operations must be a list of objects', 400)
+        operations = [(operation.get('op'), operation.get('slug'), operation.get('qty')) for operation in operations]
+        cart = self.get_or_create_cart() if any(op == 'add' for op, _, _ in operations) else self.cart
+        try:
+            apply_cart_operations(cart, operations)
+        except CartOperationError as e:
+            return error_response(str(e), 400)
+        return self.cart_response()
+
+    @staticmethod
+    def payload(request):
+        if request.content_type == 'application/json':
+            try:
+                payload = json.loads(request.body or b'{}')
+            except ValueError:
+                return {}
+            return payload if isinstance(payload, dict) else {}
+        return request.POST
+
+    def cart_response(self):
+        response = JsonResponse(cart_json(self.cart), encoder=DjangoJSONEncoder)
+        response['Cache-Control'] = 'private, no-store'
+        return response
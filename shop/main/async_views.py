@@ -0,0 +1,191 @@
+import asyncio
+from functools import update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import Http404
+from django.shortcuts import get_object_or_404, render
+from django.views.generic import View
+
+from .facets import price_facets
+from .forms import CatalogFilterForm
+from .mixins import resolve_cart
+from .models import Category, Product
+from .page_cache import (
+    PAGE_CACHE_TIMEOUT, cache_page_response, get_cached_page, not_modified_response, page_validators,
+    request_is_cacheable, set_validators
+)
+from .pagination import KeysetPaginator
+from .sidebar import get_sidebar_categories
+from .utils import CartContents
+from .views import PRODUCT_CARD_FIELDS, BaseView, CategoryDetailView, ProductDetailView, category_listing_context
+
+
+def run_sync(func, *args, **kwargs):
+    """
+    Run a blocking ORM or cache call on a worker thread, so several can be
+    awaited together. Each worker thread keeps its own DB connection, which
+    is closed afterwards unless CONN_MAX_AGE allows reuse.
+    """
+    def call():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(call, thread_sensitive=False)()
+
+
+class AsyncView(View):
+    """``View`` whose handlers are coroutines; Django 3.1 only awaits async function views."""
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            return await view(request, *args, **kwargs)
+
+        update_wrapper(async_view, view)
+        return async_view
+
+    async def dispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        handler = getattr(self, method, None) if method in self.http_method_names else None
+        if handler is None:
+            return self.http_method_not_allowed(request, *args, **kwargs)
+        response = handler(request, *args, **kwargs)
+        if asyncio.iscoroutine(response):
+            response = await response
+        return response
+
+
+class AsyncCartMixin(AsyncView):
+    """Resolves the cart when ``load_cart`` is awaited, so views can gather it with other lookups."""
+
+    async def load_cart(self):
+        self.cart = await run_sync(resolve_cart, self.request)
+        return self.cart
+
+
+class AsyncAnonymousPageCacheMixin(AsyncView):
+
+    page_cache_timeout = PAGE_CACHE_TIMEOUT
+
+    async def dispatch(self, request, *args, **kwargs):
+        if not await run_sync(request_is_cacheable, request):
+            return await super().dispatch(request, *args, **kwargs)
+        response = await run_sync(get_cached_page, request)
+        if response is not None:
+            return response
+        request.cart_badge_deferred = True
+        response = await super().dispatch(request, *args, **kwargs)
+        return await run_sync(cache_page_response, request, response, self.page_cache_timeout)
+
+
+class AsyncConditionalPageMixin(AsyncView):
+
+    async def dispatch(self, request, *args, **kwargs):
+        if not await run_sync(request_is_cacheable, request):
+            return await super().dispatch(request, *args, **kwargs)
+        last_modified = await run_sync(self.get_page_last_modified, request, *args, **kwargs)
+        if last_modified is None:
+            return await super().dispatch(request, *args, **kwargs)
+        etag, last_modified = await run_sync(page_validators, request, last_modified)
+        response = not_modified_response(request, etag, last_modified)
+        if response is not None:
+            return response
+        response = await super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200:
+            set_validators(response, etag, last_modified)
+        return response
+
+
+class AsyncBaseView(AsyncAnonymousPageCacheMixin, AsyncCartMixin):
+
+    paginate_by = BaseView.paginate_by
+    carousel_size = BaseView.carousel_size
+
+    async def get(self, request, *args, **kwargs):
+        carousel_products = Product.objects.only('id', 'image', 'has_derivatives', 'image_width').order_by('-id')[:self.carousel_size]
+        paginator = KeysetPaginator(Product.objects.only(*PRODUCT_CARD_FIELDS), self.paginate_by)
+        categories, carousel_products, page, cart = await asyncio.gather(
+            run_sync(get_sidebar_categories),
+            run_sync(list, carousel_products),
+            run_sync(paginator.page_from_request, request),
+            self.load_cart(),
+        )
+        context = {
+            'categories': categories,
+            'carousel_products': carousel_products,
+            'products': page,
+            'page': page,
+            'cart': cart
+            }
+        return await run_sync(render, request, 'index.html', context)
+
+
+class AsyncProductDetailView(AsyncAnonymousPageCacheMixin, AsyncConditionalPageMixin, AsyncCartMixin):
+
+    get_page_last_modified = ProductDetailView.get_page_last_modified
+
+    async def get(self, request, *args, **kwargs):
+        product, categories, cart = await asyncio.gather(
+            run_sync(get_object_or_404, Product.objects.select_related('category'), slug=kwargs.get('slug')),
+            run_sync(get_sidebar_categories),
+            self.load_cart(),
+        )
+        context = {
+            'object': product,
+            'product': product,
+            'ct_model': Product._meta.model_name,
+            'categories': categories,
+            'cart': cart
+            }
+        return await run_sync(render, request, 'product_detail.html', context)
+
+
+class AsyncCategoryDetailView(AsyncAnonymousPageCacheMixin, AsyncConditionalPageMixin, AsyncCartMixin):
+
+    paginate_by = CategoryDetailView.paginate_by
+    get_page_last_modified = CategoryDetailView.get_page_last_modified
+
+    async def get(self, request, *args, **kwargs):
+        slug = kwargs.get('slug')
+        filter_form = CatalogFilterForm(request.GET)
+        # Filtering on the slug lets the listing run alongside the category lookup.
+        products = Product.objects.filter(category__slug=slug)
+        paginator = KeysetPaginator(
+            filter_form.filter_queryset(products).only(*PRODUCT_CARD_FIELDS),
+            self.paginate_by,
+            filter_form.get_ordering()
+        )
+        category, page, facets, categories, cart = await asyncio.gather(
+            run_sync(Category.objects.filter(slug=slug).first),
+            run_sync(paginator.page_from_request, request),
+            run_sync(price_facets, products),
+            run_sync(get_sidebar_categories),
+            self.load_cart(),
+        )
+        if category is None:
+            raise Http404('No category found matching the query')
+        context = {
+            'object': category,
+            'category': category,
+            'categories': categories,
+            'cart': cart,
+            **category_listing_context(request, filter_form, page, facets)
+            }
+        return await run_sync(render, request, 'category_detail.html', context)
+
+
+class AsyncCartView(AsyncCartMixin):
+
+    async def get(self, request, *args, **kwargs):
+        categories, cart = await asyncio.gather(run_sync(get_sidebar_categories), self.load_cart())
+        cart_contents = await run_sync(CartContents, cart)
+        context = {
+            'cart': cart,
+            'cart_contents': cart_contents,
+            'categories': categories,
+        }
+        return await run_sync(render, request, 'cart.html', context)
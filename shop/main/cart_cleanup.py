@@ -0,0 +1,92 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .jobs import enqueue, task
+from .models import Cart, CartProduct, Order
+
+
+def cart_ttl():
+    return timedelta(days=getattr(settings, 'CART_TTL_DAYS', 30))
+
+
+def stale_carts(cutoff):
+    """Carts untouched since ``cutoff`` that no order points at."""
+    return Cart.objects.filter(updated_at__lt=cutoff).filter(~Exists(Order.objects.filter(cart=OuterRef('pk'))))
+
+
+def archive_carts(cart_ids, stream):
+    carts = {
+        cart['id']: dict(cart, updated_at=cart['updated_at'].isoformat(), final_price=str(cart['final_price']), lines=[])
+        for cart in Cart.objects.filter(pk__in=cart_ids).values(
+            'id', 'owner_id', 'for_anonymous_user', 'in_order', 'total_products', 'final_price', 'updated_at'
+        )
+    }
+    lines = CartProduct.objects.filter(cart_id__in=cart_ids).order_by('id').values_list('cart_id', 'product_id', 'qty', 'total_price')
+    for cart_id, product_id, qty, total_price in lines:
+        carts[cart_id]['lines'].append({'product_id': product_id, 'qty': qty, 'total_price': str(total_price)})
+    for cart in carts.values():
+        stream.write(json.dumps(cart) + '\n')
+
+
+def prune_carts(older_than=None, batch_size=500, archive=None, pause=0):
+    """
+    Delete carts idle for longer than ``older_than`` together with their
+    lines, ``batch_size`` carts per short transaction so no lock is held
+    for long. Carts referenced by an order are kept. When ``archive`` is a
+    writable stream each cart is written to it as a JSON line first.
+    Returns {'carts', 'lines', 'seconds'}.
+    """
+    cutoff = timezone.now() - (older_than or cart_ttl())
+    stats = {'carts': 0, 'lines': 0, 'seconds': 0}
+    started = time.monotonic()
+    while True:
+        with transaction.atomic():
+            # The batch stays locked until it is deleted, so a cart cannot be
+            # touched or ordered after it was archived.
+            cart_ids = list(
+                stale_carts(cutoff).select_for_update().order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not cart_ids:
+                break
+            if archive is not None:
+                archive_carts(cart_ids, archive)
+            _, deleted = Cart.objects.filter(pk__in=cart_ids).delete()
+        stats['carts'] += deleted.get(Cart._meta.label, 0)
+        stats['lines'] += deleted.get(CartProduct._meta.label, 0)
+        if len(cart_ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    stats['seconds'] = time.monotonic() - started
+    return stats
+
+
+def schedule_prune_carts(interval, batch_size=500, after_slot=None):
+    """
+    Queue the next run at the start of the next ``interval``-second slot.
+    Keys are per slot, so retries and overlapping chains collapse into one
+    job per slot.
+    """
+    slot = int(timezone.now().timestamp()) // interval + 1
+    if after_slot is not None:
+        slot = max(slot, after_slot + 1)
+    return enqueue(
+        'prune_carts', {'interval': interval, 'batch_size': batch_size, 'slot': slot},
+        key=f'prune_carts:{slot}', run_after=datetime.fromtimestamp(slot * interval, timezone.utc)
+    )
+
+
+@task('prune_carts')
+def prune_carts_task(interval=None, batch_size=500, slot=None):
+    try:
+        prune_carts(batch_size=batch_size)
+    finally:
+        # Even after a failure, or one broken run would end the chain for good.
+        if interval:
+            schedule_prune_carts(interval, batch_size, after_slot=slot)
@@ -0,0 +1,254 @@
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from .images import derivatives_job
+from .jobs import enqueue_many
+from .models import Category, MinResolutionErrorExeption, Product, check_min_resolution
+from .page_cache import bump_catalog_version
+from .product_cache import product_cache
+from .search import get_search_index
+from .sidebar import invalidate_sidebar_categories
+
+
+CATALOG_FIELDS = ('category_slug', 'category_name', 'slug', 'title', 'description', 'price', 'image')
+PRODUCT_UPDATE_FIELDS = (
+    'category', 'title', 'description', 'price', 'image', 'has_derivatives', 'image_width', 'updated_at'
+)
+
+# Problems with one image file; they are reported for its row instead of stopping the import.
+IMAGE_ERRORS = (OSError, ValueError, SuspiciousFileOperation, MinResolutionErrorExeption, Image.DecompressionBombError)
+
+
+class CatalogRowError(ValueError):
+    pass
+
+
+def guess_format(path, default='csv'):
+    extension = os.path.splitext(path or '')[1].lower()
+    return {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}.get(extension, default)
+
+
+def read_rows(stream, fmt):
+    """
+    Yield catalog rows as dicts, one line at a time. A JSONL line that is
+    not a JSON object is yielded as a ``CatalogRowError`` so the import
+    can skip it and go on.
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield CatalogRowError(f'invalid JSON on line {line_number}: {e}')
+            continue
+        if not isinstance(row, dict):
+            yield CatalogRowError(f'line {line_number} is not a JSON object')
+            continue
+        yield row
+
+
+class CatalogWriter:
+
+    def __init__(self, stream, fmt):
+        self.stream = stream
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.writer = csv.writer(stream)
+            self.writer.writerow(CATALOG_FIELDS)
+
+    def write(self, row):
+        if self.fmt == 'csv':
+            self.writer.writerow(row)
+        else:
+            self.stream.write(json.dumps(dict(zip(CATALOG_FIELDS, row))) + '\n')
+
+
+def iter_catalog(chunk_size=2000):
+    """Catalog rows straight from the database, without building model instances."""
+    products = Product.objects.order_by('id').values_list(
+        'category__slug', 'category__name', 'slug', 'title', 'description', 'price', 'image'
+    )
+    for category_slug, category_name, slug, title, description, price, image in products.iterator(chunk_size=chunk_size):
+        yield category_slug, category_name, slug, title, description or '', str(price), image
+
+
+class CatalogImporter:
+    """
+    Upserts categories and products by slug in batches of ``batch_size``
+    rows; each batch is one transaction of a few bulk queries, so memory
+    and lock time stay bounded however large the input is.
+    """
+
+    def __init__(self, batch_size=1000, images_dir=None, workers=4, build_derivatives=True):
+        self.batch_size = batch_size
+        self.images_dir = images_dir
+        self.workers = workers
+        self.build_derivatives = build_derivatives
+        self.categories = {}
+        self.stats = {'created': 0, 'updated': 0, 'skipped': 0, 'categories': 0, 'images': 0}
+        self.errors = []
+
+    def run(self, rows):
+        batch = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            self.pool = pool
+            for line_number, row in enumerate(rows, start=1):
+                try:
+                    if isinstance(row, CatalogRowError):
+                        raise row
+                    batch.append(self.clean_row(row))
+                except CatalogRowError as e:
+                    self.stats['skipped'] += 1
+                    self.errors.append(f'Row {line_number}: {e}')
+                if len(batch) >= self.batch_size:
+                    self.import_batch(batch)
+                    batch = []
+            if batch:
+                self.import_batch(batch)
+        if self.stats['created'] or self.stats['updated']:
+            invalidate_sidebar_categories()
+            bump_catalog_version()
+        return self.stats
+
+    def clean_row(self, row):
+        missing = [field for field in ('category_slug', 'slug', 'title', 'price') if row.get(field) in (None, '')]
+        if missing:
+            raise CatalogRowError(f'missing {", ".join(missing)}')
+        try:
+            price = Decimal(str(row['price']))
+            if not price.is_finite() or price < 0:
+                raise InvalidOperation
+            price = price.quantize(Decimal('0.01'))
+        except InvalidOperation:
+            raise CatalogRowError(f'invalid price {row["price"]!r}')
+        image = row.get('image') or ''
+        if os.path.isabs(image) or os.path.normpath(image).split(os.sep)[0] == os.pardir:
+            raise CatalogRowError(f'invalid image name {image!r}')
+        return {
+            'category_slug': row['category_slug'],
+            'category_name': row.get('category_name') or row['category_slug'],
+            'slug': row['slug'],
+            'title': row['title'],
+            'description': row.get('description') or '',
+            'price': price,
+            'image': image,
+        }
+
+    def ingest_image(self, name):
+        """
+        Copy ``name`` from ``images_dir`` into media storage, reusing a
+        stored file of the same name. Returns (stored name, copied, error);
+        a file that cannot be read or stored is reported, not raised.
+        """
+        if not name or not self.images_dir:
+            return name, False, None
+        storage = Product._meta.get_field('image').storage
+        try:
+            if storage.exists(name):
+                return name, False, None
+            images_dir = os.path.realpath(self.images_dir)
+            path = os.path.realpath(os.path.join(images_dir, name))
+            if os.path.commonpath([images_dir, path]) != images_dir:
+                raise SuspiciousFileOperation(f'{name} is outside the images directory')
+            with open(path, 'rb') as image_file:
+                check_min_resolution(image_file)
+                return storage.save(name, File(image_file)), True, None
+        except IMAGE_ERRORS as e:
+            return name, False, f'Image {name}: {e}'
+
+    def resolve_categories(self, rows):
+        wanted = {row['category_slug']: row['category_name'] for row in rows}
+        unknown = [slug for slug in wanted if slug not in self.categories]
+        if unknown:
+            for category in Category.objects.filter(slug__in=unknown).only('id', 'slug'):
+                self.categories[category.slug] = category.pk
+        missing = [Category(slug=slug, name=wanted[slug]) for slug in wanted if slug not in self.categories]
+        if missing:
+            Category.objects.bulk_create(missing, ignore_conflicts=True)
+            for category in Category.objects.filter(slug__in=[c.slug for c in missing]).only('id', 'slug'):
+                self.categories[category.slug] = category.pk
+            self.stats['categories'] += len(missing)
+
+    @transaction.atomic
+    def import_batch(self, rows):
+        # Later rows win when a slug repeats inside one batch.
+        rows = list({row['slug']: row for row in rows}.values())
+        images = {}
+        for row, (name, copied, error) in zip(rows, self.pool.map(self.ingest_image, [row['image'] for row in rows])):
+            images[row['slug']] = name
+            self.stats['images'] += copied
+            if error:
+                self.errors.append(error)
+        self.resolve_categories(rows)
+
+        existing = {
+            product.slug: product
+            for product in Product.objects.filter(slug__in=[row['slug'] for row in rows]).only(
+                'id', 'slug', 'category_id', 'title', 'description', 'price', 'image', 'has_derivatives'
+            )
+        }
+        now = timezone.now()
+        to_create, to_update, replaced_images = [], [], []
+        for row in rows:
+            values = {
+                'category_id': self.categories[row['category_slug']],
+                'title': row['title'],
+                'description': row['description'],
+                'price': row['price'],
+                'image': images[row['slug']],
+            }
+            product = existing.get(row['slug'])
+            if product is None:
+                to_create.append(Product(slug=row['slug'], created_at=now, updated_at=now, **values))
+                continue
+            changed = [field for field, value in values.items() if getattr(product, field) != value]
+            if not changed:
+                continue
+            if 'image' in changed:
+                product.has_derivatives = False
+                product.image_width = None
+                if product.image:
+                    replaced_images.append(product.image.name)
+            for field, value in values.items():
+                setattr(product, field, value)
+            product.updated_at = now
+            to_update.append(product)
+
+        if to_create:
+            Product.objects.bulk_create(to_create, batch_size=self.batch_size)
+            to_create = list(Product.objects.filter(slug__in=[p.slug for p in to_create]))
+        if to_update:
+            Product.objects.bulk_update(to_update, PRODUCT_UPDATE_FIELDS, batch_size=self.batch_size)
+        touched = to_create + to_update
+        if not touched:
+            return
+        product_cache.invalidate(*(p.slug for p in touched))
+
+        Category.objects.filter(pk__in={p.category_id for p in touched}).update(catalog_updated_at=now)
+        get_search_index().index_many(touched)
+        if self.build_derivatives:
+            enqueue_many(
+                'build_product_derivatives',
+                [derivatives_job(p) for p in touched if p.image and not p.has_derivatives]
+            )
+        if replaced_images:
+            enqueue_many(
+                'delete_product_derivatives',
+                [({'image_name': name}, f'delete-derivatives:{name}:{now.timestamp()}') for name in replaced_images]
+            )
+        self.stats['created'] += len(to_create)
+        self.stats['updated'] += len(to_update)
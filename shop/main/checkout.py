@@ -0,0 +1,60 @@
+from django.db import IntegrityError, transaction
+
+from .models import Cart, CartProduct, Order, OrderItem
+
+
+class CheckoutError(Exception):
+    pass
+
+
+def order_items(cart):
+    """Unsaved ``OrderItem`` snapshots of the cart lines, from one query."""
+    lines = CartProduct.objects.filter(cart=cart).order_by('id').values_list(
+        'product_id', 'product__title', 'qty', 'total_price'
+    )
+    return [
+        OrderItem(product_id=product_id, title=title, qty=qty, unit_price=total_price / qty if qty else total_price,
+                  line_total=total_price)
+        for product_id, title, qty, total_price in lines
+    ]
+
+
+def place_order(cart, customer, order, idempotency_key=None):
+    """
+    Turn ``cart`` into ``order`` exactly once. The cart row is locked and
+    claimed with a conditional UPDATE on ``in_order`` before the order is
+    inserted with its line snapshots, so concurrent submits for one cart
+    cannot both succeed. Replaying an ``idempotency_key`` returns the order
+    it already created. Returns (order, created).
+    """
+    if idempotency_key:
+        existing = Order.objects.filter(idempotency_key=idempotency_key, customer=customer).first()
+        if existing is not None:
+            return existing, False
+    if cart.pk is None:
+        raise CheckoutError('This cart is empty.')
+    try:
+        with transaction.atomic():
+            locked = Cart.objects.select_for_update().filter(pk=cart.pk, in_order=False).first()
+            if locked is None or not Cart.objects.filter(pk=cart.pk, in_order=False).update(in_order=True):
+                raise CheckoutError('This cart has already been ordered.')
+            items = order_items(locked)
+            if not items:
+                raise CheckoutError('This cart is empty.')
+            order.customer = customer
+            order.cart = locked
+            order.idempotency_key = idempotency_key
+            order.total_products = len(items)
+            order.total = sum(item.line_total for item in items)
+            order.save(force_insert=True)
+            for item in items:
+                item.order = order
+            OrderItem.objects.bulk_create(items)
+    except (CheckoutError, IntegrityError):
+        # A concurrent submit with the same key may have won the cart.
+        existing = idempotency_key and Order.objects.filter(idempotency_key=idempotency_key, customer=customer).first()
+        if existing:
+            return existing, False
+        raise
+    cart.in_order = True
+    return order, True
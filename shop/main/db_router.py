@@ -0,0 +1,127 @@
+import asyncio
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+
+CATALOG_WRITTEN_KEY = 'main:db:catalog_written'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Per-request routing state, set by ReplicaRoutingMiddleware. Outside a
+# request (commands, jobs) every query stays on the primary.
+_request_state = ContextVar('db_routing_state', default=None)
+
+
+def get_replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+def replica_models():
+    return set(getattr(settings, 'DATABASE_REPLICA_MODELS', ('main.category', 'main.product')))
+
+
+def reporting_db():
+    """Alias for reporting reads (order exports), which tolerate replica lag."""
+    replicas = get_replicas()
+    return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+
+def mark_catalog_written():
+    # In the shared cache, so the fallback covers every worker, not just the writer.
+    lag = getattr(settings, 'DATABASE_REPLICA_LAG', 5)
+    if lag:
+        cache.set(CATALOG_WRITTEN_KEY, True, lag)
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES['default']['BACKEND']
+    if get_replicas() and getattr(settings, 'DATABASE_REPLICA_LAG', 5) and backend.endswith(('.LocMemCache', '.DummyCache')):
+        return [checks.Warning(
+            'DATABASE_REPLICAS is set but the default cache is not shared between processes.',
+            hint='Catalog writes only send the writing process back to the primary during '
+                 'DATABASE_REPLICA_LAG; configure a shared cache backend.',
+            obj=backend,
+            id='main.W001',
+        )]
+    return []
+
+
+class ReplicaRouter:
+    """
+    Catalog reads (``DATABASE_REPLICA_MODELS``) in safe requests go to one
+    of ``DATABASE_REPLICAS``; everything else uses the primary. A request
+    is pinned to the primary once it writes anything, so it reads its own
+    writes, and for ``DATABASE_REPLICA_LAG`` seconds after any catalog
+    write all catalog reads fall back to the primary while the replicas
+    catch up.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        if state is None or state['pinned'] or model._meta.label_lower not in replica_models():
+            return DEFAULT_DB_ALIAS
+        replicas = get_replicas()
+        if not replicas:
+            return DEFAULT_DB_ALIAS
+        if state['catalog_written'] is None:
+            # Looked up once per request, and only by requests that read the catalog.
+            state['catalog_written'] = bool(cache.get(CATALOG_WRITTEN_KEY))
+        if state['catalog_written']:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['pinned'] = True
+        if model._meta.label_lower in replica_models():
+            mark_catalog_written()
+            # Again at commit, since replication lag starts from there.
+            transaction.on_commit(mark_catalog_written, using=DEFAULT_DB_ALIAS)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias is a copy of the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema only; data migrations (RunPython/RunSQL
+        # without hints) run on the primary and reach them by replication.
+        return db == DEFAULT_DB_ALIAS or model_name is not None
+
+
+class ReplicaRoutingMiddleware:
+    """Scopes ``ReplicaRouter`` state to a request; unsafe methods start pinned to the primary."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    @staticmethod
+    def state(request):
+        return {'pinned': request.method not in SAFE_METHODS, 'catalog_written': None}
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        token = _request_state.set(self.state(request))
+        try:
+            return self.get_response(request)
+        finally:
+            _request_state.reset(token)
+
+    async def __acall__(self, request):
+        token = _request_state.set(self.state(request))
+        try:
+            return await self.get_response(request)
+        finally:
+            _request_state.reset(token)
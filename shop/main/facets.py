@@ -0,0 +1,29 @@
+from decimal import Decimal
+
+from django.db.models import Case, Count, IntegerField, Value, When
+
+
+PRICE_BUCKETS = (
+    Decimal('0'), Decimal('100'), Decimal('500'), Decimal('1000'), Decimal('5000'), None
+)
+
+
+def price_facets(queryset, bounds=PRICE_BUCKETS):
+    """
+    Product counts per ``[low, high)`` price bucket, from one grouped query.
+    Returns a list of dicts with ``min_price``, ``max_price`` and ``count``.
+    """
+    buckets = list(zip(bounds[:-1], bounds[1:]))
+    bucket = Case(
+        *[When(price__lt=high, then=Value(i)) for i, (low, high) in enumerate(buckets) if high is not None],
+        default=Value(len(buckets) - 1),
+        output_field=IntegerField()
+    )
+    counts = dict(
+        queryset.filter(price__gte=bounds[0]).order_by()
+        .annotate(bucket=bucket).values('bucket').annotate(count=Count('id')).values_list('bucket', 'count')
+    )
+    return [
+        {'min_price': low, 'max_price': high, 'count': counts.get(i, 0)}
+        for i, (low, high) in enumerate(buckets)
+    ]
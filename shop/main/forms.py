@@ -6,7 +6,53 @@ from .models import Order
 class OrderForm(forms.ModelForm):
 
     order_date = forms.DateField(widget=forms.SelectDateWidget(attrs={'type': 'date'}))
+    idempotency_key = forms.CharField(max_length=64, required=False, widget=forms.HiddenInput)
 
     class Meta:
         model = Order
         fields = ('first_name', 'last_name', 'phone', 'address', 'buying_type', 'order_date', 'comment')
+
+    def clean_idempotency_key(self):
+        return self.cleaned_data['idempotency_key'] or None
+
+
+class CatalogFilterForm(forms.Form):
+
+    SORT_DEFAULT = ''
+    SORT_PRICE = 'price'
+    SORT_PRICE_DESC = '-price'
+    SORT_NEWEST = 'newest'
+
+    SORT_CHOICES = (
+        (SORT_DEFAULT, 'Default'),
+        (SORT_PRICE, 'Price: low to high'),
+        (SORT_PRICE_DESC, 'Price: high to low'),
+        (SORT_NEWEST, 'Newest')
+    )
+
+    # Keyset orderings; each ends on the unique id and matches a (category, ...) index.
+    SORT_ORDERINGS = {
+        SORT_DEFAULT: ('id',),
+        SORT_PRICE: ('price', 'id'),
+        SORT_PRICE_DESC: ('-price', '-id'),
+        SORT_NEWEST: ('-created_at', '-id'),
+    }
+
+    min_price = forms.DecimalField(required=False, min_value=0, decimal_places=2, label='Price from')
+    max_price = forms.DecimalField(required=False, min_value=0, decimal_places=2, label='Price below')
+    sort = forms.ChoiceField(
+        required=False, choices=SORT_CHOICES, label='Sort by', widget=forms.Select(attrs={'class': 'form-control'})
+    )
+
+    def filter_queryset(self, queryset):
+        if not self.is_valid():
+            return queryset
+        if self.cleaned_data['min_price'] is not None:
+            queryset = queryset.filter(price__gte=self.cleaned_data['min_price'])
+        if self.cleaned_data['max_price'] is not None:
+            queryset = queryset.filter(price__lt=self.cleaned_data['max_price'])
+        return queryset
+
+    def get_ordering(self):
+        sort = self.cleaned_data.get('sort', '') if self.is_valid() else ''
+        return self.SORT_ORDERINGS[sort or self.SORT_DEFAULT]
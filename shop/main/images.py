@@ -0,0 +1,112 @@
+import logging
+import os
+from io import BytesIO
+
+from PIL import Image
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from .jobs import task
+from .models import Category, Product
+from .page_cache import bump_catalog_version
+
+
+logger = logging.getLogger(__name__)
+
+# Rendered slot -> widths (1x, 2x) generated for it.
+PRODUCT_IMAGE_SIZES = {
+    'cart': (160, 320),
+    'card': (200, 400),
+    'detail': (600, 1200),
+    'carousel': (800, 1600),
+}
+DERIVATIVE_FORMATS = (
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+)
+
+
+def derivative_widths():
+    return sorted({width for widths in PRODUCT_IMAGE_SIZES.values() for width in widths})
+
+
+def derivative_name(image_name, width, extension):
+    stem = os.path.splitext(image_name)[0]
+    return f'derivatives/{stem}-{width}w.{extension}'
+
+
+def _encode(image, width, pil_format, options):
+    if image.width > width:
+        height = round(image.height * width / image.width)
+        image = image.resize((width, height), Image.LANCZOS)
+    if pil_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def generate_product_derivatives(product):
+    """
+    Write the JPEG and WebP thumbnails for ``product.image`` next to the
+    original and flag the product so templates start serving them.
+    Returns False when the upload cannot be decoded.
+    """
+    if not product.image:
+        return False
+    storage = product.image.storage
+    try:
+        with product.image.open('rb') as image_file:
+            source = Image.open(image_file)
+            source.load()
+    except (OSError, ValueError):
+        logger.warning('Cannot build derivatives for product %s: unreadable image %s', product.pk, product.image.name)
+        return False
+
+    for width in derivative_widths():
+        for extension, pil_format, options in DERIVATIVE_FORMATS:
+            name = derivative_name(product.image.name, width, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(_encode(source, width, pil_format, options)))
+
+    # A queryset update skips the save signals, so refresh the page validators and cached pages here.
+    now = timezone.now()
+    Product.objects.filter(pk=product.pk).update(has_derivatives=True, image_width=source.width, updated_at=now)
+    Category.objects.filter(pk=product.category_id).update(catalog_updated_at=now)
+    bump_catalog_version()
+    product.has_derivatives = True
+    product.image_width = source.width
+    product.updated_at = now
+    return True
+
+
+def delete_product_derivatives(image_name, storage):
+    for width in derivative_widths():
+        for extension, _, _ in DERIVATIVE_FORMATS:
+            name = derivative_name(image_name, width, extension)
+            if storage.exists(name):
+                storage.delete(name)
+
+
+def derivatives_job(product):
+    """
+    Payload and idempotency key of the ``build_product_derivatives`` job.
+    The key includes the save time, so an image uploaded again under the
+    same name is not blocked by the finished job of the old upload.
+    """
+    payload = {'product_id': product.pk, 'image_name': product.image.name}
+    return payload, f'product-derivatives:{product.pk}:{product.image.name}:{product.updated_at.timestamp()}'
+
+
+@task('build_product_derivatives')
+def build_product_derivatives(product_id, image_name):
+    product = Product.objects.filter(pk=product_id).first()
+    if product is None or product.image.name != image_name or product.has_derivatives:
+        return
+    generate_product_derivatives(product)
+
+
+@task('delete_product_derivatives')
+def remove_product_derivatives(image_name):
+    delete_product_derivatives(image_name, Product._meta.get_field('image').storage)
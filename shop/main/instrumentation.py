@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template
+
+from .query_budget import counts_toward_budget, get_query_budget
+
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('perf_recorder', default=None)
+_stats = {}
+_stats_lock = threading.Lock()
+_installed = False
+_MISS = object()
+
+
+class Recorder:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.db_time += elapsed
+                self.queries += counts_toward_budget(sql)
+
+    def server_timing(self, total):
+        return ', '.join([
+            f'total;dur={total * 1000:.1f}',
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'cache;desc="{self.cache_hits} hits {self.cache_misses} misses"',
+        ])
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    recorder = _current.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def _add_execute_wrapper(connection, **kwargs):
+    if _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_wrapper)
+
+
+def _timed_render(render):
+    def wrapper(self, *args, **kwargs):
+        recorder = _current.get()
+        if recorder is None:
+            return render(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            recorder.template_time += time.perf_counter() - started
+    return wrapper
+
+
+def _counted_get(get):
+    def wrapper(self, key, default=None, version=None):
+        recorder = _current.get()
+        if recorder is None:
+            return get(self, key, default, version)
+        value = get(self, key, _MISS, version)
+        if value is _MISS:
+            recorder.cache_misses += 1
+            return default
+        recorder.cache_hits += 1
+        return value
+    return wrapper
+
+
+def _counted_get_many(get_many):
+    def wrapper(self, keys, version=None):
+        keys = list(keys)
+        values = get_many(self, keys, version)
+        recorder = _current.get()
+        if recorder is not None:
+            recorder.cache_hits += len(values)
+            recorder.cache_misses += len(keys) - len(values)
+        return values
+    return wrapper
+
+
+def install():
+    """Hook template rendering and the configured cache backends, once per process."""
+    global _installed
+    if _installed:
+        return
+    # Every connection, on whichever thread runs the query, reports to the
+    # recorder of the request it belongs to (context variables follow
+    # sync_to_async into worker threads).
+    connection_created.connect(_add_execute_wrapper)
+    for connection in connections.all():
+        _add_execute_wrapper(connection)
+    Template.render = _timed_render(Template.render)
+    for backend in {type(caches[alias]) for alias in settings.CACHES}:
+        backend.get = _counted_get(backend.get)
+        backend.get_many = _counted_get_many(backend.get_many)
+    _installed = True
+
+
+def record(name, recorder, total):
+    budget = get_query_budget(name)
+    over_budget = budget is not None and recorder.queries > budget
+    if over_budget:
+        logger.warning('%s ran %s queries, budget is %s', name, recorder.queries, budget)
+    with _stats_lock:
+        entry = _stats.get(name)
+        if entry is None:
+            entry = _stats[name] = {
+                'requests': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'queries': 0, 'db_ms': 0.0,
+                'template_ms': 0.0, 'cache_hits': 0, 'cache_misses': 0, 'over_budget': 0
+            }
+        entry['requests'] += 1
+        entry['total_ms'] += total * 1000
+        entry['max_ms'] = max(entry['max_ms'], total * 1000)
+        entry['queries'] += recorder.queries
+        entry['db_ms'] += recorder.db_time * 1000
+        entry['template_ms'] += recorder.template_time * 1000
+        entry['cache_hits'] += recorder.cache_hits
+        entry['cache_misses'] += recorder.cache_misses
+        entry['over_budget'] += over_budget
+
+
+def get_stats():
+    """Per-URL-name aggregates of the sampled requests in this process, slowest first."""
+    with _stats_lock:
+        stats = {name: dict(entry) for name, entry in _stats.items()}
+    for entry in stats.values():
+        requests = entry['requests']
+        entry['avg_ms'] = entry['total_ms'] / requests
+        entry['avg_queries'] = entry['queries'] / requests
+        lookups = entry['cache_hits'] + entry['cache_misses']
+        entry['cache_hit_rate'] = entry['cache_hits'] / lookups if lookups else None
+    return dict(sorted(stats.items(), key=lambda item: -item[1]['total_ms']))
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+class PerformanceMiddleware:
+    """
+    Times a sample of requests (``PERF_SAMPLE_RATE``, 0..1): wall time, DB
+    queries and time, template rendering and cache hits/misses. Results go
+    to per-URL-name aggregates and, with ``PERF_SERVER_TIMING`` on, to a
+    ``Server-Timing`` header; that exposes internal timings to every
+    client, so leave it off in production.
+    Unsampled requests pay for one random() call. Works under WSGI and ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Lets Django call this middleware without a thread hop.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        install()
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+        recorder = Recorder()
+        token = _current.set(recorder)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, recorder, response)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+        recorder = Recorder()
+        token = _current.set(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, recorder, response)
+
+    @staticmethod
+    def sampled():
+        sample_rate = getattr(settings, 'PERF_SAMPLE_RATE', 1.0)
+        return bool(sample_rate) and random.random() < sample_rate
+
+    @staticmethod
+    def finish(request, recorder, response):
+        total = time.perf_counter() - recorder.started
+        match = getattr(request, 'resolver_match', None)
+        record(match.view_name if match else 'unresolved', recorder, total)
+        if getattr(settings, 'PERF_SERVER_TIMING', False):
+            response['Server-Timing'] = recorder.server_timing(total)
+        return response
@@ -0,0 +1,156 @@
+import logging
+import threading
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+_tasks = {}
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def task(name):
+    """Register ``func`` as a job handler; payload items are passed as kwargs."""
+    def decorator(func):
+        _tasks[name] = func
+        return func
+    return decorator
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def get_executor():
+    """
+    Shared pool used to run jobs right after their transaction commits.
+    ``JOBS_EXECUTOR`` is 'thread', 'process' or None to leave jobs for
+    the ``drain_jobs`` command. The pool only makes the first attempt:
+    retries, delayed jobs and jobs left behind by a dead process are run
+    by ``drain_jobs --loop``, so keep one running wherever jobs are used.
+    """
+    global _executor
+    kind = _setting('JOBS_EXECUTOR', 'thread')
+    if kind is None:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            workers = _setting('JOBS_WORKERS', 2)
+            if kind == 'process':
+                # Forked workers must not share the parent's open database connections.
+                _executor = ProcessPoolExecutor(max_workers=workers, initializer=connections.close_all)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=workers)
+        return _executor
+
+
+def enqueue(task_name, payload=None, key=None, max_attempts=3, run_after=None):
+    """
+    Store a job and schedule it on the pool once the current transaction
+    commits. Enqueueing an existing ``key`` returns the stored job instead
+    of creating a second one. Jobs with a future ``run_after`` wait for
+    ``drain_jobs``.
+    """
+    if task_name not in _tasks:
+        raise KeyError(f'Unknown job task: {task_name}')
+    job, created = Job.objects.get_or_create(
+        key=key or f'{task_name}:{uuid.uuid4().hex}',
+        defaults={
+            'task': task_name, 'payload': payload or {}, 'max_attempts': max_attempts,
+            'run_after': run_after or timezone.now()
+        }
+    )
+    if created and job.run_after <= timezone.now():
+        transaction.on_commit(lambda: _submit(job.pk))
+    return job
+
+
+def enqueue_many(task_name, jobs, max_attempts=3):
+    """
+    Store ``(payload, key)`` jobs, in the argument order of ``enqueue``, in
+    one INSERT, skipping keys that already exist. They are not handed to
+    the pool; ``drain_jobs`` picks them up.
+    """
+    if task_name not in _tasks:
+        raise KeyError(f'Unknown job task: {task_name}')
+    Job.objects.bulk_create(
+        [Job(key=key, task=task_name, payload=payload, max_attempts=max_attempts) for payload, key in jobs],
+        ignore_conflicts=True
+    )
+
+
+def _submit(job_id):
+    executor = get_executor()
+    if executor is not None:
+        executor.submit(run_job, job_id)
+
+
+def _claim(job_id):
+    now = timezone.now()
+    return Job.objects.filter(pk=job_id, status=Job.STATUS_PENDING, run_after__lte=now).update(
+        status=Job.STATUS_RUNNING, attempts=F('attempts') + 1, updated_at=now
+    ) == 1
+
+
+def run_job(job_id):
+    """Claim and execute one job. Returns False if another worker owns it."""
+    close_old_connections()
+    try:
+        if not _claim(job_id):
+            return False
+        job = Job.objects.get(pk=job_id)
+        try:
+            _tasks[job.task](**job.payload)
+        except Exception:
+            _fail(job, traceback.format_exc())
+        else:
+            Job.objects.filter(pk=job.pk).update(status=Job.STATUS_DONE, last_error=None, updated_at=timezone.now())
+        return True
+    finally:
+        close_old_connections()
+
+
+def _fail(job, error):
+    logger.warning('Job %s (%s) failed on attempt %s', job.pk, job.task, job.attempts)
+    now = timezone.now()
+    if job.attempts < job.max_attempts:
+        status = Job.STATUS_PENDING
+        run_after = now + timedelta(seconds=_setting('JOBS_RETRY_DELAY', 30) * 2 ** (job.attempts - 1))
+    else:
+        status = Job.STATUS_FAILED
+        run_after = job.run_after
+    Job.objects.filter(pk=job.pk).update(status=status, run_after=run_after, last_error=error, updated_at=now)
+
+
+def requeue_stale(older_than=None):
+    """Return jobs left running by a worker that died back to pending."""
+    older_than = older_than or timedelta(seconds=_setting('JOBS_STALE_AFTER', 15 * 60))
+    return Job.objects.filter(
+        status=Job.STATUS_RUNNING, updated_at__lt=timezone.now() - older_than
+    ).update(status=Job.STATUS_PENDING)
+
+
+def due_job_ids(limit=None):
+    jobs = Job.objects.filter(status=Job.STATUS_PENDING, run_after__lte=timezone.now()).order_by('run_after', 'id')
+    jobs = jobs.values_list('id', flat=True)
+    return list(jobs[:limit] if limit else jobs)
+
+
+def drain(limit=None, workers=0):
+    """Run every due job, inline or on a pool of ``workers`` threads."""
+    job_ids = due_job_ids(limit)
+    if workers:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return sum(pool.map(run_job, job_ids))
+    return sum(run_job(job_id) for job_id in job_ids)
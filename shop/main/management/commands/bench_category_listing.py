@@ -0,0 +1,76 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from main.facets import price_facets
+from main.forms import CatalogFilterForm
+from main.models import Category, Product
+from main.pagination import KeysetPaginator
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Time filtered category listings at growing catalog sizes (data is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"products":>10} {"first page ms":>14} {"deep page ms":>13} {"facets ms":>10}')
+        try:
+            with transaction.atomic():
+                categories = Category.objects.bulk_create([
+                    Category(name=f'Bench {i}', slug=f'bench-{i}') for i in range(options['categories'])
+                ])
+                categories = list(Category.objects.filter(slug__startswith='bench-').order_by('id'))
+                created = 0
+                for size in sorted(options['sizes']):
+                    self.fill(categories, created, size)
+                    created = size
+                    self.stdout.write(self.measure(categories[0], size, options['repeat']))
+                raise Rollback
+        except Rollback:
+            pass
+
+    def fill(self, categories, start, stop, batch_size=5000):
+        for batch_start in range(start, stop, batch_size):
+            Product.objects.bulk_create([
+                Product(
+                    category=categories[i % len(categories)],
+                    title=f'Bench product {i}',
+                    slug=f'bench-product-{i}',
+                    image='bench.jpg',
+                    price=Decimal(i % 2000) + Decimal('0.99')
+                )
+                for i in range(batch_start, min(batch_start + batch_size, stop))
+            ])
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def measure(self, category, size, repeat):
+        form = CatalogFilterForm({'min_price': '100', 'max_price': '900', 'sort': CatalogFilterForm.SORT_PRICE})
+        products = Product.objects.filter(category=category)
+        paginator = KeysetPaginator(form.filter_queryset(products), 24, form.get_ordering())
+
+        first_page = self.timed(lambda: paginator.page(), repeat)
+        cursor = paginator.page().next_cursor
+        for _ in range(10):
+            cursor = paginator.page(after=cursor).next_cursor or cursor
+        deep_page = self.timed(lambda: paginator.page(after=cursor), repeat)
+        facets = self.timed(lambda: price_facets(products), max(repeat // 10, 1))
+        return f'{size:>10} {first_page:>14.3f} {deep_page:>13.3f} {facets:>10.3f}'
+
+    @staticmethod
+    def timed(func, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - started) * 1000 / repeat
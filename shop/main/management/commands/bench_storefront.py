@@ -0,0 +1,113 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+
+from main.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = 'Compare storefront requests per second under the WSGI (sync views) and ASGI (async views) handlers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=('wsgi', 'asgi', 'both'), default='both')
+        parser.add_argument('--concurrency', type=int, default=64)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--cached', action='store_true', help='Let repeated anonymous pages come from the page cache')
+
+    def handle(self, *args, **options):
+        if options['server'] == 'both':
+            # Each handler runs in its own process so it gets its own URLconf (see ASYNC_STOREFRONT).
+            self.stdout.write(f'{"server":>6} {"views":>6} {"concurrency":>11} {"requests":>8} {"req/s":>8} {"p50 ms":>7} {"p95 ms":>7}')
+            for server in ('wsgi', 'asgi'):
+                command = [
+                    sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'bench_storefront', '--server', server,
+                    '--concurrency', str(options['concurrency']), '--requests', str(options['requests'])
+                ]
+                if options['cached']:
+                    command.append('--cached')
+                env = dict(os.environ, SHOP_ASYNC_STOREFRONT='1' if server == 'asgi' else '0')
+                result = subprocess.run(command, env=env, capture_output=True, text=True)
+                if result.returncode:
+                    raise CommandError(result.stderr)
+                self.stdout.write(result.stdout.rstrip().splitlines()[-1])
+            return
+
+        paths = self.paths()
+        paths = [paths[i % len(paths)] for i in range(options['requests'])]
+        run = self.run_wsgi if options['server'] == 'wsgi' else self.run_asgi
+        # Without --cached every page is rendered, as for a logged-in visitor.
+        with override_settings(PAGE_CACHE=options['cached']):
+            run(paths[:options['concurrency']], options['concurrency'])
+            started = time.perf_counter()
+            latencies = run(paths, options['concurrency'])
+            elapsed = time.perf_counter() - started
+        latencies.sort()
+        views = 'async' if settings.ASYNC_STOREFRONT else 'sync'
+        self.stdout.write(
+            f'{options["server"]:>6} {views:>6} {options["concurrency"]:>11} {len(paths):>8} {len(paths) / elapsed:>8.0f} '
+            f'{latencies[len(latencies) // 2] * 1000:>7.1f} {latencies[int(len(latencies) * 0.95)] * 1000:>7.1f}'
+        )
+
+    def paths(self):
+        category = Category.objects.order_by('id').first()
+        product = Product.objects.order_by('id').first()
+        if category is None or product is None:
+            raise CommandError('The catalog is empty; load one with import_catalog first.')
+        return ['/', category.get_absolute_url(), product.get_absolute_url(), '/cart/']
+
+    def run_wsgi(self, paths, concurrency):
+        handler = WSGIHandler()
+        factory = RequestFactory()
+
+        def request(path):
+            environ = factory.get(path, HTTP_HOST='localhost').environ
+            started = time.perf_counter()
+            response = handler(environ, lambda status, headers: None)
+            b''.join(response)
+            response.close()
+            if not 200 <= response.status_code < 400:
+                raise CommandError(f'{path} answered {response.status_code}')
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(request, paths))
+
+    def run_asgi(self, paths, concurrency):
+        handler = ASGIHandler()
+
+        async def request(path, semaphore):
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+                'path': path, 'raw_path': path.encode(), 'query_string': b'', 'headers': [(b'host', b'localhost')],
+                'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+            }
+            status = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            async with semaphore:
+                started = time.perf_counter()
+                await handler(scope, receive, send)
+                if not 200 <= status[0] < 400:
+                    raise CommandError(f'{path} answered {status[0]}')
+                return time.perf_counter() - started
+
+        async def run_all():
+            semaphore = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(request(path, semaphore) for path in paths))
+
+        return list(asyncio.run(run_all()))
@@ -0,0 +1,37 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from main.models import Cart
+from main.utils import recalc_cart
+
+
+class Command(BaseCommand):
+    help = 'Compare stored cart totals with their lines and optionally repair drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='Recompute totals for carts that drifted')
+        parser.add_argument('--include-ordered', action='store_true', help='Also check carts already in an order')
+
+    def handle(self, *args, **options):
+        carts = Cart.objects.annotate(
+            lines=Count('related_products'),
+            lines_total=Coalesce(Sum('related_products__total_price'), Decimal('0'))
+        ).filter(~Q(total_products=F('lines')) | ~Q(final_price=F('lines_total')))
+        if not options['include_ordered']:
+            carts = carts.filter(in_order=False)
+
+        drifted = 0
+        for cart in carts.iterator():
+            drifted += 1
+            self.stdout.write(
+                f'Cart {cart.pk}: stored {cart.total_products}/{cart.final_price}, '
+                f'lines {cart.lines}/{cart.lines_total}'
+            )
+            if options['repair']:
+                recalc_cart(cart)
+
+        action = 'repaired' if options['repair'] else 'found'
+        self.stdout.write(self.style.SUCCESS(f'{drifted} drifted carts {action}'))
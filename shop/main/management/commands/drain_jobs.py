@@ -0,0 +1,39 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from main import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Run queued background jobs until the queue is empty. Web processes only make the first attempt of a job; '
+        'retries with backoff, delayed jobs and jobs of crashed workers only run here, so keep `drain_jobs --loop` '
+        'running in production.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=0, help='Run jobs on a pool of this many threads')
+        parser.add_argument('--limit', type=int, default=None, help='Run at most this many jobs per pass')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new jobs instead of exiting')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls with --loop')
+        parser.add_argument('--stale-after', type=int, default=None, help='Requeue jobs running longer than this many seconds')
+
+    def handle(self, *args, **options):
+        stale_after = options['stale_after']
+        requeued = jobs.requeue_stale(timedelta(seconds=stale_after) if stale_after else None)
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale jobs')
+
+        total = 0
+        while True:
+            ran = jobs.drain(limit=options['limit'], workers=options['workers'])
+            total += ran
+            if not options['loop']:
+                if ran and options['limit'] is None:
+                    continue
+                break
+            if not ran:
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'{total} jobs run'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from main.catalog_io import CatalogWriter, guess_format, iter_catalog
+
+
+class Command(BaseCommand):
+    help = 'Stream every product as CSV or JSONL to a file or stdout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), default=None)
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        output = options['output']
+        fmt = options['format'] or guess_format(output)
+        if output == '-':
+            self.export(self.stdout, fmt, options['chunk_size'])
+        else:
+            with open(output, 'w', newline='', encoding='utf-8') as stream:
+                count = self.export(stream, fmt, options['chunk_size'])
+            self.stderr.write(f'{count} products exported to {output}')
+
+    def export(self, stream, fmt, chunk_size):
+        writer = CatalogWriter(stream, fmt)
+        count = 0
+        for count, row in enumerate(iter_catalog(chunk_size), start=1):
+            writer.write(row)
+        return count
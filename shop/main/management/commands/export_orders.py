@@ -0,0 +1,30 @@
+import csv
+
+from django.core.management.base import BaseCommand
+
+from main.reports import ORDER_EXPORT_FIELDS, iter_order_rows
+
+
+class Command(BaseCommand):
+    help = 'Stream every order line with its customer and totals as CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--database', help='Alias to read from; a replica by default when one is configured')
+
+    def handle(self, *args, **options):
+        if options['output'] == '-':
+            self.export(self.stdout, options['chunk_size'], options['database'])
+            return
+        with open(options['output'], 'w', newline='', encoding='utf-8') as stream:
+            count = self.export(stream, options['chunk_size'], options['database'])
+        self.stderr.write(f'{count} rows exported to {options["output"]}')
+
+    def export(self, stream, chunk_size, using=None):
+        writer = csv.writer(stream)
+        writer.writerow(ORDER_EXPORT_FIELDS)
+        count = 0
+        for count, row in enumerate(iter_order_rows(chunk_size, using=using), start=1):
+            writer.writerow(row)
+        return count
@@ -0,0 +1,45 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.catalog_io import CatalogImporter, guess_format, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Upsert categories and products by slug from a CSV or JSONL file (use - for stdin)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), default=None)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--images-dir', default=None, help='Directory holding the files named in the image column')
+        parser.add_argument('--workers', type=int, default=4, help='Threads used to copy images')
+        parser.add_argument('--no-derivatives', action='store_true', help='Do not queue thumbnail jobs')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        fmt = options['format'] or guess_format(options['path'])
+        importer = CatalogImporter(
+            batch_size=options['batch_size'],
+            images_dir=options['images_dir'],
+            workers=options['workers'],
+            build_derivatives=not options['no_derivatives']
+        )
+        started = time.monotonic()
+        if options['path'] == '-':
+            stats = importer.run(read_rows(sys.stdin, fmt))
+        else:
+            try:
+                with open(options['path'], newline='', encoding='utf-8') as stream:
+                    stats = importer.run(read_rows(stream, fmt))
+            except OSError as e:
+                raise CommandError(e)
+        for error in importer.errors:
+            self.stderr.write(error)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['created']} created, {stats['updated']} updated, {stats['skipped']} skipped, "
+            f"{stats['categories']} categories, {stats['images']} images in {elapsed:.1f}s"
+        ))
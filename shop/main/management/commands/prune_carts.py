@@ -0,0 +1,33 @@
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from main.cart_cleanup import cart_ttl, prune_carts, schedule_prune_carts
+
+
+class Command(BaseCommand):
+    help = 'Delete (and optionally archive) idle carts that are not part of an order'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=None, help='Idle time before a cart is pruned (CART_TTL_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--archive', default=None, help='Append pruned carts to this JSON lines file')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between batches')
+        parser.add_argument('--schedule', type=int, default=None, metavar='SECONDS',
+                            help='Queue a prune job that repeats every SECONDS instead of pruning now')
+
+    def handle(self, *args, **options):
+        if options['schedule']:
+            job = schedule_prune_carts(options['schedule'], options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Prune job {job.key} runs after {job.run_after:%Y-%m-%d %H:%M:%S}'))
+            return
+        older_than = timedelta(days=options['days']) if options['days'] is not None else cart_ttl()
+        archive = open(options['archive'], 'a', encoding='utf-8') if options['archive'] else nullcontext()
+        with archive:
+            stats = prune_carts(older_than, options['batch_size'], archive if options['archive'] else None, options['pause'])
+        rows = stats['carts'] + stats['lines']
+        rate = rows / stats['seconds'] if stats['seconds'] else rows
+        self.stdout.write(self.style.SUCCESS(
+            f'{stats["carts"]} carts and {stats["lines"]} lines removed in {stats["seconds"]:.2f}s ({rate:.0f} rows/s)'
+        ))
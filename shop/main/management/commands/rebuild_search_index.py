@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from main.search import get_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product search index from the Product table'
+
+    def handle(self, *args, **options):
+        index = get_search_index()
+        index.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt ({index.__class__.__name__})'))
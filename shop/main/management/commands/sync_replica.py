@@ -0,0 +1,24 @@
+import sqlite3
+from contextlib import closing
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = 'Copy the sqlite primary database over a local sqlite replica, standing in for replication'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='replica')
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        if alias == DEFAULT_DB_ALIAS or alias not in connections:
+            raise CommandError(f'{alias!r} is not a replica alias')
+        source, target = connections[DEFAULT_DB_ALIAS].settings_dict, connections[alias].settings_dict
+        if {source['ENGINE'], target['ENGINE']} != {'django.db.backends.sqlite3'}:
+            raise CommandError('Only sqlite databases can be synced; use the database server replication otherwise.')
+        connections[alias].close()
+        with closing(sqlite3.connect(source['NAME'])) as primary, closing(sqlite3.connect(target['NAME'])) as replica:
+            primary.backup(replica)
+        self.stdout.write(f'{target["NAME"]} now matches {source["NAME"]}')
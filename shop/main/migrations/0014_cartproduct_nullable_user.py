@@ -0,0 +1,19 @@
+# Generated by Django 3.1.1 on 2026-10-18 19:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_auto_20201124_1338'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cartproduct',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='main.customer', verbose_name='Customer'),
+        ),
+    ]
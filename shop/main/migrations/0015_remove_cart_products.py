@@ -0,0 +1,62 @@
+from django.db import migrations
+
+
+BATCH_SIZE = 2000
+
+
+def cart_products_through(apps):
+    Cart = apps.get_model('main', 'Cart')
+    return Cart._meta.get_field('products').remote_field.through
+
+
+def copy_m2m_to_fk(apps, schema_editor):
+    CartProduct = apps.get_model('main', 'CartProduct')
+    Through = cart_products_through(apps)
+    last_id = 0
+    while True:
+        rows = list(
+            Through.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'cart_id', 'cartproduct_id')[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        cart_ids = {cartproduct_id: cart_id for _, cart_id, cartproduct_id in rows}
+        stale = list(
+            CartProduct.objects.filter(id__in=cart_ids).only('id', 'cart_id')
+        )
+        stale = [cart_product for cart_product in stale if cart_product.cart_id != cart_ids[cart_product.id]]
+        for cart_product in stale:
+            cart_product.cart_id = cart_ids[cart_product.id]
+        CartProduct.objects.bulk_update(stale, ['cart'], batch_size=BATCH_SIZE)
+
+
+def copy_fk_to_m2m(apps, schema_editor):
+    CartProduct = apps.get_model('main', 'CartProduct')
+    Through = cart_products_through(apps)
+    last_id = 0
+    while True:
+        rows = list(
+            CartProduct.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'cart_id')[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        Through.objects.bulk_create(
+            [Through(cart_id=cart_id, cartproduct_id=cartproduct_id) for cartproduct_id, cart_id in rows],
+            batch_size=BATCH_SIZE
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_cartproduct_nullable_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_m2m_to_fk, copy_fk_to_m2m),
+        migrations.RemoveField(
+            model_name='cart',
+            name='products',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.1 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_remove_cart_products'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='has_derivatives',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
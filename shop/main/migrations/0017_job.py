@@ -0,0 +1,34 @@
+# Generated by Django 3.1.1 on 2026-10-18 20:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_product_has_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True, verbose_name='Idempotency key')),
+                ('task', models.CharField(max_length=255, verbose_name='Task name')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='Payload')),
+                ('status', models.CharField(choices=[('pending', 'Job pending'), ('running', 'Job running'), ('done', 'Job done'), ('failed', 'Job failed')], default='pending', max_length=32, verbose_name='Job status')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=3)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Run after')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='Last error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Job created date')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Job updated date')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'run_after'], name='main_job_status_f8f41d_idx'),
+        ),
+    ]
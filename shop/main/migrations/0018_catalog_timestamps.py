@@ -0,0 +1,29 @@
+# Generated by Django 3.1.1 on 2026-10-18 20:02
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='catalog_updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Category products updated date'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Category updated date'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Product updated date'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+
+FTS_TABLE = 'main_product_fts'
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Product = apps.get_model('main', 'Product')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            f"USING fts5(title, description, tokenize='unicode61 remove_diacritics 2')"
+        )
+        rows = Product.objects.order_by('id').values_list('id', 'title', 'description')
+        batch = []
+        for product_id, title, description in rows.iterator(chunk_size=2000):
+            batch.append((product_id, title, description or ''))
+            if len(batch) >= 2000:
+                cursor.executemany(f'INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (%s, %s, %s)', batch)
+                batch = []
+        if batch:
+            cursor.executemany(f'INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (%s, %s, %s)', batch)
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_catalog_timestamps'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 3.1.1 on 2026-10-18 20:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+BATCH_SIZE = 1000
+
+
+def snapshot_existing_orders(apps, schema_editor):
+    Order = apps.get_model('main', 'Order')
+    OrderItem = apps.get_model('main', 'OrderItem')
+    CartProduct = apps.get_model('main', 'CartProduct')
+    last_id = 0
+    while True:
+        orders = list(
+            Order.objects.filter(id__gt=last_id, cart__isnull=False).order_by('id').only('id', 'cart_id')[:BATCH_SIZE]
+        )
+        if not orders:
+            break
+        last_id = orders[-1].id
+        lines = {}
+        cart_lines = CartProduct.objects.filter(cart_id__in={order.cart_id for order in orders}).order_by('id').values_list(
+            'cart_id', 'product_id', 'product__title', 'qty', 'total_price'
+        )
+        for cart_id, product_id, title, qty, total_price in cart_lines:
+            lines.setdefault(cart_id, []).append((product_id, title, qty, total_price))
+        items = []
+        for order in orders:
+            order_lines = lines.get(order.cart_id, [])
+            order.total_products = len(order_lines)
+            order.total = sum(line[3] for line in order_lines)
+            items.extend(
+                OrderItem(order=order, product_id=product_id, title=title, qty=qty,
+                          unit_price=total_price / qty if qty else total_price, line_total=total_price)
+                for product_id, title, qty, total_price in order_lines
+            )
+        Order.objects.bulk_update(orders, ['total_products', 'total'], batch_size=BATCH_SIZE)
+        OrderItem.objects.bulk_create(items, batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0021_order_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=9, verbose_name='Order total'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_products',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255, verbose_name='Title')),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Unit price')),
+                ('qty', models.PositiveIntegerField(default=1)),
+                ('line_total', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Line total')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='main.order', verbose_name='Order')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.product', verbose_name='Goods')),
+            ],
+        ),
+        migrations.RunPython(snapshot_existing_orders, migrations.RunPython.noop),
+    ]
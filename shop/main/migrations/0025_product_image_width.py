@@ -0,0 +1,24 @@
+# Generated by Django 3.1.1 on 2026-10-18 20:59
+
+from django.db import migrations, models
+import main.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0024_cart_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_width',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(upload_to='', validators=[main.models.validate_min_resolution], verbose_name='Image'),
+        ),
+    ]
@@ -1,24 +1,112 @@
-from django.views.generic.detail import SingleObjectMixin
 from django.views.generic import View
 
 from .models import Cart, Customer
+from .page_cache import (
+    PAGE_CACHE_TIMEOUT, cache_page_response, get_cached_page, not_modified_response, page_validators,
+    request_is_cacheable, set_validators
+)
+
+
+CART_SESSION_KEY = 'cart_id'
+
+
+def resolve_cart(request):
+    """The visitor's open cart from one query, or an unsaved ``Cart``."""
+    user = request.user
+    carts = Cart.objects.select_related('owner').filter(in_order=False)
+    cart_id = request.session.get(CART_SESSION_KEY)
+    cart = None
+
+    if cart_id:
+        cart = carts.filter(pk=cart_id).first()
+        if cart is not None and cart.owner_id is not None:
+            if not user.is_authenticated or cart.owner.user_id != user.pk:
+                cart = None
+    if cart is None and user.is_authenticated:
+        cart = carts.filter(owner__user=user).order_by('-id').first()
+    if cart is None:
+        request.session.pop(CART_SESSION_KEY, None)
+        return Cart(for_anonymous_user=not user.is_authenticated)
+
+    if cart_id != cart.pk:
+        request.session[CART_SESSION_KEY] = cart.pk
+    return cart
+
 
 class CartMixin(View):
+    """
+    Resolves the visitor's open cart in a single query and keeps its id in
+    the session. Visitors without a cart get an unsaved ``Cart``; views that
+    write to it call ``get_or_create_cart`` so browsing never creates rows.
+    """
 
     def dispatch(self, request, *args, **kwargs):
+        self.cart = self.resolve_cart(request)
+        return super().dispatch(request, *args, **kwargs)
 
-        if request.user.is_authenticated:
-            customer = Customer.objects.filter(user=request.user).first()
-            if not customer:
-                customer = Customer.objects.create(user=request.user)
-            cart = Cart.objects.filter(owner=customer, in_order=False).first()
-            if not cart:
-                cart = Cart.objects.create(owner=customer)
-        else:
-            cart = Cart.objects.filter(for_anonymous_user=True)
-            if not cart:
-                cart = Cart.objects.create(for_anonymous_user=True)
-        self.cart = cart
+    def resolve_cart(self, request):
+        return resolve_cart(request)
 
-        return super().dispatch(request, *args, **kwargs)
+    def get_or_create_cart(self):
+        cart = self.cart
+        user = self.request.user
+        if user.is_authenticated and cart.owner_id is None:
+            customer = Customer.objects.filter(user=user).first()
+            if customer is None:
+                customer = Customer.objects.create(user=user)
+            cart.owner = customer
+            cart.for_anonymous_user = False
+            if cart.pk:
+                cart.save(update_fields=['owner', 'for_anonymous_user', 'updated_at'])
+                cart.related_products.filter(user__isnull=True).update(user=customer)
+        if cart.pk is None:
+            cart.save()
+        if self.request.session.get(CART_SESSION_KEY) != cart.pk:
+            self.request.session[CART_SESSION_KEY] = cart.pk
+        return cart
 
+
+class AnonymousPageCacheMixin(View):
+    """
+    Serves anonymous catalog pages from the cache before any cart lookup.
+    Keys include the catalog version, so Product/Category changes retire
+    every cached page at once; the cart badge is loaded by the page itself.
+    """
+
+    page_cache_timeout = PAGE_CACHE_TIMEOUT
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request_is_cacheable(request):
+            return super().dispatch(request, *args, **kwargs)
+        response = get_cached_page(request)
+        if response is not None:
+            return response
+        request.cart_badge_deferred = True
+        response = super().dispatch(request, *args, **kwargs)
+        return cache_page_response(request, response, self.page_cache_timeout)
+
+
+class ConditionalPageMixin(View):
+    """
+    Answers anonymous conditional GETs with 304 from one indexed lookup of
+    ``get_page_last_modified``, before the cart is resolved or anything is
+    rendered, and stamps ETag/Last-Modified on full responses.
+    """
+
+    def get_page_last_modified(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request_is_cacheable(request):
+            return super().dispatch(request, *args, **kwargs)
+        last_modified = self.get_page_last_modified(request, *args, **kwargs)
+        if last_modified is None:
+            return super().dispatch(request, *args, **kwargs)
+        etag, last_modified = page_validators(request, last_modified)
+        response = not_modified_response(request, etag, last_modified)
+        if response is not None:
+            return response
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200:
+            set_validators(response, etag, last_modified)
+        return response
@@ -1,11 +1,9 @@
-import sys
-from io import BytesIO
-from PIL import Image
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth import get_user_model
-from django.contrib.contenttypes.models import ContentType
 from django.urls import reverse
 from django.utils import timezone
+from PIL import Image
 
 
 User = get_user_model()
@@ -20,16 +18,42 @@ def get_product_url(obj, view_name):
 class MinResolutionErrorExeption(Exception):
     pass
 
+def check_min_resolution(image_file):
+    image_file.seek(0)
+    image = Image.open(image_file)
+    image_file.seek(0)
+    min_width, min_height = Product.MIN_RESOLUTION
+    if image.width < min_width or image.height < min_height:
+        raise MinResolutionErrorExeption(
+            f'Image resolution {image.width}x{image.height} is lower than {min_width}x{min_height}'
+        )
+
+def validate_min_resolution(image):
+    # Stored files were checked when they were uploaded.
+    if not image or getattr(image, '_committed', True):
+        return
+    try:
+        check_min_resolution(image)
+    except MinResolutionErrorExeption as e:
+        raise ValidationError(str(e))
+    except OSError:
+        raise ValidationError('Upload a valid image.')
+
 class Category(models.Model):
 
     __tablename__ = 'Categories'
 
     name = models.CharField(max_length=255, verbose_name='Category name')
     slug = models.SlugField(unique=True)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Category updated date')
+    catalog_updated_at = models.DateTimeField(default=timezone.now, editable=False, verbose_name='Category products updated date')
 
     def __str__(self):
         return self.name
 
+    def get_last_modified(self):
+        return max(self.updated_at, self.catalog_updated_at)
+
     def get_absolute_url(self):
         return reverse('category_detail', kwargs={'slug': self.slug})
 
@@ -40,13 +64,44 @@ class Product(models.Model):
     category = models.ForeignKey(Category, verbose_name='Category', on_delete=models.CASCADE)
     title = models.CharField(max_length=255, verbose_name='Product title')
     slug = models.SlugField(unique=True)
-    image = models.ImageField(verbose_name='Image')
+    image = models.ImageField(verbose_name='Image', validators=[validate_min_resolution])
     description = models.TextField(verbose_name='Description', null=True)
     price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Price')
+    has_derivatives = models.BooleanField(default=False, editable=False)
+    # Width of the source image, recorded with the derivatives; none are wider.
+    image_width = models.PositiveIntegerField(null=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Product created date')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Product updated date')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+            models.Index(fields=['category', 'created_at', 'id'], name='product_category_created_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'image' in field_names:
+            instance._loaded_image_name = values[field_names.index('image')]
+        if 'category_id' in field_names:
+            instance._loaded_category_id = values[field_names.index('category_id')]
+        if 'slug' in field_names:
+            instance._loaded_slug = values[field_names.index('slug')]
+        return instance
+
+    def save(self, *args, **kwargs):
+        if self.image.name != getattr(self, '_loaded_image_name', None):
+            self.has_derivatives = False
+            self.image_width = None
+        super().save(*args, **kwargs)
+        self._loaded_image_name = self.image.name
+        self._loaded_category_id = self.category_id
+        self._loaded_slug = self.slug
+
     def get_model_name(self):
         return self.__class__.__name__.lower()
 
@@ -54,7 +109,7 @@ class Product(models.Model):
         return reverse('product_detail', kwargs={'slug': self.slug})
 class CartProduct(models.Model):
 
-    user = models.ForeignKey('Customer', verbose_name='Customer', on_delete=models.CASCADE)
+    user = models.ForeignKey('Customer', null=True, blank=True, verbose_name='Customer', on_delete=models.CASCADE)
     cart = models.ForeignKey('Cart', verbose_name='Cart', on_delete=models.CASCADE, related_name='related_products')
     product = models.ForeignKey(Product, verbose_name='Goods', on_delete=models.CASCADE)
     qty = models.PositiveIntegerField(default=1)
@@ -70,21 +125,30 @@ class CartProduct(models.Model):
 class Cart(models.Model):
 
     owner = models.ForeignKey('Customer', null=True, verbose_name='Owner', on_delete=models.CASCADE)
-    products = models.ManyToManyField(CartProduct, blank=True, related_name='related_cart')
     total_products = models.PositiveIntegerField(default=0)
     final_price = models.DecimalField(max_digits=9, decimal_places=2, default=0, verbose_name='Final price')
     in_order = models.BooleanField(default=False)
     for_anonymous_user = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Cart updated date')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], name='cart_updated_idx'),
+        ]
 
     def __str__(self):
         return str(self.id)
 
+    @property
+    def products(self):
+        # Lines are owned through CartProduct.cart; kept for templates using cart.products.
+        return self.related_products
+
 class Customer(models.Model):
 
     user = models.ForeignKey(User, verbose_name='Customer', on_delete=models.CASCADE)
     phone = models.CharField(max_length=20, null=True, blank=True, verbose_name='Phone')
     address = models.CharField(max_length=255, null=True, blank=True, verbose_name='Address')
-    orders = models.ManyToManyField('Order', related_name='related_customer', verbose_name='Customer`s orders')
 
     def __str__(self):
         return f'Customer: {self.user.first_name} {self.user.last_name}'
@@ -120,8 +184,60 @@ class Order(models.Model):
     status = models.CharField(max_length=128, verbose_name='Order status', choices=STATUS_CHOICES, default=STATUS_NEW)
     buying_type = models.CharField(max_length=128, verbose_name='Order buying type', choices=BUYING_TYPE_CHOICES, default=BUYING_TYPE_SELF)
     comment = models.TextField(verbose_name='Order comment', null=True, blank=True)
-    created_at = models.DateTimeField(auto_now=True, verbose_name='Order created date')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Order created date')
     order_date = models.DateField(verbose_name='Get order date', default=timezone.now)
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True, verbose_name='Idempotency key')
+    total_products = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=9, decimal_places=2, default=0, verbose_name='Order total')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', '-created_at', '-id'], name='order_customer_created_idx'),
+        ]
 
     def __str__(self):
         return str(self.id)
+
+class OrderItem(models.Model):
+    """Line copied from the cart at checkout; later price changes do not touch it."""
+
+    order = models.ForeignKey(Order, verbose_name='Order', related_name='items', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, verbose_name='Goods', null=True, blank=True, on_delete=models.SET_NULL)
+    title = models.CharField(max_length=255, verbose_name='Title')
+    unit_price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Unit price')
+    qty = models.PositiveIntegerField(default=1)
+    line_total = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Line total')
+
+    def __str__(self):
+        return f'Order item: {self.title}'
+
+class Job(models.Model):
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Job pending'),
+        (STATUS_RUNNING, 'Job running'),
+        (STATUS_DONE, 'Job done'),
+        (STATUS_FAILED, 'Job failed')
+    )
+
+    key = models.CharField(max_length=255, unique=True, verbose_name='Idempotency key')
+    task = models.CharField(max_length=255, verbose_name='Task name')
+    payload = models.JSONField(default=dict, blank=True, verbose_name='Payload')
+    status = models.CharField(max_length=32, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name='Job status')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now, verbose_name='Run after')
+    last_error = models.TextField(null=True, blank=True, verbose_name='Last error')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Job created date')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Job updated date')
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f'{self.task} ({self.status})'
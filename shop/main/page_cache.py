@@ -0,0 +1,110 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from .sidebar import get_sidebar_changed_at
+
+
+CATALOG_VERSION_KEY = 'main:catalog:version'
+PAGE_CACHE_TIMEOUT = 60 * 15
+VALIDATOR_HEADERS = ('ETag', 'Last-Modified')
+# Query parameters the cached pages render differently for. Pages may echo
+# any other parameter (pagination and facet links keep the query string), so
+# requests carrying one are rendered, not cached.
+PAGE_CACHE_PARAMS = ('after', 'before', 'sort', 'min_price', 'max_price')
+
+
+def initial_catalog_version():
+    # From the clock, so a version lost to eviction or a restart never
+    # comes back as one that already has cached pages and ETags.
+    return time.time_ns() // 1000
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, initial_catalog_version(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version if version is not None else initial_catalog_version()
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, initial_catalog_version(), None)
+
+
+def page_cache_key(request):
+    params = urlencode([(name, request.GET[name]) for name in PAGE_CACHE_PARAMS if request.GET.get(name)])
+    return f'main:page:{get_catalog_version()}:{request.path}?{params}'
+
+
+def request_is_cacheable(request):
+    """Only anonymous GETs with known parameters and no pending flash messages share a cached page."""
+    if not getattr(settings, 'PAGE_CACHE', True):
+        return False
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    if any(name not in PAGE_CACHE_PARAMS for name in request.GET):
+        return False
+    return 'messages' not in request.COOKIES and '_messages' not in request.session
+
+
+def page_validators(request, last_modified):
+    """
+    ETag and Last-Modified for a page whose own data changed at
+    ``last_modified``; the shared sidebar is folded in so count changes
+    elsewhere in the catalog still refresh the page.
+    """
+    last_modified = max(last_modified, get_sidebar_changed_at())
+    digest = hashlib.md5(f'{request.get_full_path()}:{last_modified.isoformat()}'.encode()).hexdigest()
+    return quote_etag(digest), int(last_modified.timestamp())
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def not_modified_response(request, etag, last_modified):
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def get_cached_page(request):
+    cached = cache.get(page_cache_key(request))
+    if cached is None:
+        return None
+    content, content_type, headers = cached
+    response = None
+    if 'ETag' in headers:
+        response = get_conditional_response(
+            request, etag=headers['ETag'], last_modified=parse_http_date_safe(headers.get('Last-Modified'))
+        )
+    if response is None:
+        response = HttpResponse(content, content_type=content_type)
+    for header, value in headers.items():
+        response[header] = value
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def cache_page_response(request, response, timeout=PAGE_CACHE_TIMEOUT):
+    if response.status_code != 200 or response.streaming:
+        return response
+    if hasattr(response, 'render') and callable(response.render):
+        response.render()
+    headers = {header: response[header] for header in VALIDATOR_HEADERS if response.has_header(header)}
+    cache.set(page_cache_key(request), (response.content, response['Content-Type'], headers), timeout)
+    patch_vary_headers(response, ('Cookie',))
+    return response
@@ -0,0 +1,106 @@
+import base64
+import binascii
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, ordering, has_next, has_previous):
+        self.object_list = object_list
+        self.ordering = ordering
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def _cursor(self, obj):
+        # Rows may be model instances or dicts from a values() queryset.
+        get = obj.get if isinstance(obj, dict) else lambda name: getattr(obj, name)
+        values = [str(get(field.lstrip('-'))) for field in self.ordering]
+        return base64.urlsafe_b64encode('|'.join(values).encode()).decode()
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return self._cursor(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return self._cursor(self.object_list[0])
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination over a unique ordering, so page N costs the same
+    indexed range scan as page 1 instead of an OFFSET over the whole table.
+    The last field of ``ordering`` must be unique (normally ``id``).
+    """
+
+    def __init__(self, queryset, per_page, ordering=('id',)):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        except (binascii.Error, UnicodeError, ValueError):
+            return None
+        parts = raw.split('|')
+        if len(parts) != len(self.ordering):
+            return None
+        values = []
+        for field_name, part in zip(self.ordering, parts):
+            field = self.queryset.model._meta.get_field(field_name.lstrip('-'))
+            try:
+                values.append(field.to_python(part))
+            except ValidationError:
+                return None
+        return values
+
+    def _seek(self, values, forward):
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            descending = field.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            step = Q(**{f'{name}__{lookup}': values[i]})
+            for prev, value in zip(self.ordering[:i], values[:i]):
+                step &= Q(**{prev.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    @staticmethod
+    def _reverse(ordering):
+        return [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+    def page(self, after=None, before=None):
+        after_values = self.decode_cursor(after)
+        before_values = self.decode_cursor(before)
+        limit = self.per_page + 1
+
+        if before_values is not None:
+            qs = self.queryset.filter(self._seek(before_values, forward=False))
+            rows = list(qs.order_by(*self._reverse(self.ordering))[:limit])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return KeysetPage(rows, self.ordering, has_next=True, has_previous=has_previous)
+
+        qs = self.queryset
+        if after_values is not None:
+            qs = qs.filter(self._seek(after_values, forward=True))
+        rows = list(qs.order_by(*self.ordering)[:limit])
+        has_next = len(rows) > self.per_page
+        return KeysetPage(rows[:self.per_page], self.ordering, has_next=has_next, has_previous=after_values is not None)
+
+    def page_from_request(self, request):
+        return self.page(after=request.GET.get('after'), before=request.GET.get('before'))
@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.http import Http404
+
+from .models import Product
+
+
+# In model field order, as Model.from_db expects for a subset of fields.
+PRODUCT_CACHE_FIELDS = ('id', 'category_id', 'title', 'slug', 'image', 'price')
+PRODUCT_CACHE_TIMEOUT = 60 * 60
+PRODUCT_CACHE_SIZE = 1024
+PRODUCT_LOCAL_TTL = 5
+
+_MISSING = 'missing'
+
+
+class ProductLookupCache:
+    """
+    Slug -> product lookups from a bounded per-process LRU in front of the
+    shared cache. Only the fields in ``PRODUCT_CACHE_FIELDS`` are kept;
+    the rest load on access like ``only()``. A change drops the shared
+    entry and this process's copy at once and again at commit; other
+    processes may serve their local copy for up to ``local_ttl`` seconds
+    more, so prices for orders and carts are always reloaded from the
+    primary. Unknown slugs are cached too.
+    """
+
+    def __init__(self, size=PRODUCT_CACHE_SIZE, local_ttl=PRODUCT_LOCAL_TTL, timeout=PRODUCT_CACHE_TIMEOUT):
+        self.size = size
+        self.local_ttl = local_ttl
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.reset_stats()
+
+    @staticmethod
+    def key(slug):
+        return f'main:product:{slug}'
+
+    def get(self, slug):
+        """The product with ``slug`` or None."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(slug)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(slug)
+                self.local_hits += 1
+                return self.build(entry[1])
+        values = cache.get(self.key(slug))
+        if values is not None:
+            shared_hit = True
+        else:
+            shared_hit = False
+            # From the primary: a lagging replica would cache the old row for every process.
+            values = Product.objects.using(DEFAULT_DB_ALIAS).filter(slug=slug).values_list(*PRODUCT_CACHE_FIELDS).first() or _MISSING
+            cache.set(self.key(slug), values, self.timeout)
+        with self.lock:
+            if shared_hit:
+                self.shared_hits += 1
+            else:
+                self.misses += 1
+            self.entries[slug] = (now + self.local_ttl, values)
+            self.entries.move_to_end(slug)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return self.build(values)
+
+    @staticmethod
+    def build(values):
+        if values == _MISSING:
+            return None
+        # from_db marks the fields that were not cached as deferred.
+        return Product.from_db('default', PRODUCT_CACHE_FIELDS, values)
+
+    def invalidate(self, *slugs):
+        self.drop(slugs)
+        if transaction.get_connection(DEFAULT_DB_ALIAS).in_atomic_block:
+            # Again at commit: a lookup before then refills from the old row.
+            transaction.on_commit(lambda: self.drop(slugs), using=DEFAULT_DB_ALIAS)
+
+    def drop(self, slugs):
+        with self.lock:
+            for slug in slugs:
+                self.entries.pop(slug, None)
+        cache.delete_many([self.key(slug) for slug in slugs])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.local_hits + self.shared_hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.size,
+                'local_hits': self.local_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': (self.local_hits + self.shared_hits) / lookups if lookups else None,
+                'local_hit_rate': self.local_hits / lookups if lookups else None,
+            }
+
+    def reset_stats(self):
+        self.local_hits = self.shared_hits = self.misses = 0
+
+
+product_cache = ProductLookupCache(
+    size=getattr(settings, 'PRODUCT_CACHE_SIZE', PRODUCT_CACHE_SIZE),
+    local_ttl=getattr(settings, 'PRODUCT_CACHE_LOCAL_TTL', PRODUCT_LOCAL_TTL),
+)
+
+
+def get_product(slug):
+    return product_cache.get(slug)
+
+
+def get_product_or_404(slug):
+    product = product_cache.get(slug)
+    if product is None:
+        raise Http404('No product found matching the query')
+    return product
@@ -0,0 +1,94 @@
+from contextlib import ContextDecorator
+
+from django.conf import settings
+from django.db import connections
+
+
+SAVEPOINT_STATEMENTS = ('SAVEPOINT ', 'RELEASE SAVEPOINT ', 'ROLLBACK TO SAVEPOINT ')
+
+# Queries each URL name is meant to run on its heaviest ordinary path: a
+# first visit, logged in or anonymous, with cold caches, creating the
+# customer and cart where the view does. Savepoints are not counted; how
+# many run depends on how deeply the caller nests transactions (tests nest
+# everything), not on the view. Override or extend with QUERY_BUDGETS.
+DEFAULT_QUERY_BUDGETS = {
+    'base': 6,
+    'product_detail': 6,
+    'category_detail': 7,
+    'search': 6,
+    'cart': 5,
+    'cart_badge': 3,
+    # session, user, cart, product, customer lookup and insert, cart insert,
+    # price, line lookup and insert, totals update, session save
+    'add_to_cart': 12,
+    'delete_from_cart': 7,
+    'change_qty': 8,
+    'update_cart': 9,
+    'checkout': 5,
+    'make_order': 12,
+    'order_history': 6,
+    'order_export': 2,
+    'perf_stats': 2,
+    'api_categories': 1,
+    'api_products': 1,
+    'api_product_detail': 1,
+    'api_cart': 4,
+    'api_cart_action': 9,
+    'api_cart_batch': 9,
+}
+
+
+def get_query_budget(url_name):
+    return {**DEFAULT_QUERY_BUDGETS, **getattr(settings, 'QUERY_BUDGETS', {})}.get(url_name)
+
+
+def counts_toward_budget(sql):
+    return not sql.startswith(SAVEPOINT_STATEMENTS)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class query_budget(ContextDecorator):
+    """
+    Fail with ``QueryBudgetExceeded`` when the wrapped block runs more
+    queries than ``max_queries`` or the budget configured for ``url_name``.
+    Works as a context manager or as a test method decorator. Queries on
+    every database alias count unless ``using`` names one; savepoints
+    never do.
+    """
+
+    def __init__(self, url_name=None, max_queries=None, using=None):
+        self.url_name = url_name
+        self.max_queries = max_queries if max_queries is not None else get_query_budget(url_name)
+        if self.max_queries is None:
+            raise KeyError(f'No query budget for {url_name!r}')
+        self.using = using
+
+    def record(self, execute, sql, params, many, context):
+        if counts_toward_budget(sql):
+            self.captured_queries.append(sql if params is None or many else f'{sql} {tuple(params)}')
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.captured_queries = []
+        self.connections = [connections[alias] for alias in ([self.using] if self.using else connections)]
+        # Removed by identity on exit, not popped: PerformanceMiddleware may
+        # append its own wrapper when a connection opens inside the block.
+        for connection in self.connections:
+            connection.execute_wrappers.append(self.record)
+        return self.captured_queries
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for connection in self.connections:
+            connection.execute_wrappers.remove(self.record)
+        if exc_type is not None:
+            return False
+        executed = len(self.captured_queries)
+        if executed > self.max_queries:
+            queries = '\n'.join(f'{i}. {sql}' for i, sql in enumerate(self.captured_queries, start=1))
+            raise QueryBudgetExceeded(
+                f'{self.url_name or "Block"} ran {executed} queries, budget is {self.max_queries}:\n{queries}'
+            )
+        return False
@@ -0,0 +1,56 @@
+import csv
+
+from .db_router import reporting_db
+from .models import Order, OrderItem
+
+
+ORDER_EXPORT_FIELDS = (
+    'order_id', 'created_at', 'order_date', 'status', 'buying_type', 'customer_id', 'username',
+    'first_name', 'last_name', 'phone', 'address', 'cart_id', 'total_products', 'total',
+    'product_slug', 'product_title', 'unit_price', 'qty', 'line_total'
+)
+
+
+def iter_order_rows(chunk_size=1000, orders=None, using=None):
+    """
+    One row per order item (orders without items get a single row with empty
+    item columns). Orders are read in id-ordered chunks and each chunk's
+    items come from one more query, so memory stays flat and there is no N+1.
+    Reads go to a replica when one is configured.
+    """
+    using = using or reporting_db()
+    orders = Order.objects.all() if orders is None else orders
+    orders = orders.using(using).order_by('id').values_list(
+        'id', 'created_at', 'order_date', 'status', 'buying_type', 'customer_id', 'customer__user__username',
+        'first_name', 'last_name', 'phone', 'address', 'cart_id', 'total_products', 'total'
+    )
+    last_id = 0
+    while True:
+        chunk = list(orders.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        last_id = chunk[-1][0]
+        items = {}
+        order_items = OrderItem.objects.using(using).filter(order_id__in=[order[0] for order in chunk]).order_by('order_id', 'id')
+        order_items = order_items.values_list('order_id', 'product__slug', 'title', 'unit_price', 'qty', 'line_total')
+        for order_id, *item in order_items:
+            items.setdefault(order_id, []).append(item)
+        for order in chunk:
+            for item in items.get(order[0]) or [('', '', '', '', '')]:
+                yield (*order, *item)
+        if len(chunk) < chunk_size:
+            return
+
+
+class Echo:
+    """File-like object whose write() hands the value back, for streaming csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
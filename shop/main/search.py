@@ -0,0 +1,260 @@
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+
+from .models import Product
+
+
+FTS_TABLE = 'main_product_fts'
+TITLE_WEIGHT = 3
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+SEARCH_GENERATION_KEY = 'main:search:generation'
+SEARCH_CHANGE_TIMEOUT = 60 * 60 * 24
+# Further behind than this, a process rebuilds instead of replaying the change log.
+MAX_REPLAYED_CHANGES = 1000
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+class SqliteFTSIndex:
+    """Products indexed in an FTS5 table keyed by product id, ranked with bm25."""
+
+    def index(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT OR REPLACE INTO {FTS_TABLE}(rowid, title, description) VALUES (%s, %s, %s)',
+                [product.pk, product.title, product.description or '']
+            )
+
+    def index_many(self, products):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT OR REPLACE INTO {FTS_TABLE}(rowid, title, description) VALUES (%s, %s, %s)',
+                [(product.pk, product.title, product.description or '') for product in products]
+            )
+
+    def remove(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+    def rebuild(self, batch_size=2000):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            rows = Product.objects.order_by('id').values_list('id', 'title', 'description')
+            batch = []
+            for row in rows.iterator(chunk_size=batch_size):
+                batch.append((row[0], row[1], row[2] or ''))
+                if len(batch) >= batch_size:
+                    cursor.executemany(f'INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (%s, %s, %s)', batch)
+                    batch = []
+            if batch:
+                cursor.executemany(f'INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (%s, %s, %s)', batch)
+
+    def search(self, query, limit, offset=0):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        match = ' '.join('"{}"'.format(term) for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, {TITLE_WEIGHT}.0, 1.0) LIMIT %s OFFSET %s',
+                [match, limit, offset]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+def change_key(generation):
+    return f'main:search:change:{generation}'
+
+
+def get_search_generation():
+    generation = cache.get(SEARCH_GENERATION_KEY)
+    if generation is None:
+        # From the clock, so a lost counter never reuses old change keys.
+        cache.add(SEARCH_GENERATION_KEY, time.time_ns() // 1000, None)
+        generation = cache.get(SEARCH_GENERATION_KEY)
+    return generation
+
+
+def publish_changes(product_ids):
+    """Appends ``product_ids`` to the shared change log that every InvertedIndex replays."""
+    try:
+        generation = cache.incr(SEARCH_GENERATION_KEY, len(product_ids))
+    except ValueError:
+        # No counter: a fresh one jumps ahead, so every process rebuilds.
+        get_search_generation()
+        return
+    first = generation - len(product_ids) + 1
+    cache.set_many(
+        {change_key(first + i): product_id for i, product_id in enumerate(product_ids)}, SEARCH_CHANGE_TIMEOUT
+    )
+
+
+class InvertedIndex:
+    """
+    Pure-Python BM25 index held in process memory, for databases without
+    FTS5. It is built from the table on first use and patched by the
+    Product signals of this process, which also publish the changed ids to
+    a change log in the shared cache at commit. Other processes replay
+    the log on their next search, reloading only those products; a
+    process rebuilds only when cold or when the log has been lost.
+    Writes that bypass ``index``/``remove`` are not seen until a rebuild.
+    """
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._generation = None
+        self._postings = defaultdict(dict)
+        self._documents = {}
+        self._total_length = 0
+
+    def _ensure_built(self):
+        generation = get_search_generation()
+        if not self._built or not 0 <= generation - self._generation <= MAX_REPLAYED_CHANGES:
+            self.rebuild()
+        elif generation != self._generation:
+            self._replay(generation)
+
+    def _replay(self, generation):
+        keys = [change_key(n) for n in range(self._generation + 1, generation + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys):
+            self.rebuild()
+            return
+        product_ids = set(changes.values())
+        rows = Product.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=product_ids)
+        for product_id, title, description in rows.values_list('id', 'title', 'description'):
+            self._discard(product_id)
+            self._add(product_id, title, description)
+            product_ids.discard(product_id)
+        for product_id in product_ids:
+            self._discard(product_id)
+        self._generation = generation
+
+    @staticmethod
+    def _publish(product_ids):
+        transaction.on_commit(lambda: publish_changes(product_ids), using=DEFAULT_DB_ALIAS)
+
+    def _add(self, product_id, title, description):
+        frequencies = defaultdict(int)
+        for term in tokenize(title):
+            frequencies[term] += TITLE_WEIGHT
+        for term in tokenize(description):
+            frequencies[term] += 1
+        length = sum(frequencies.values())
+        for term, frequency in frequencies.items():
+            self._postings[term][product_id] = frequency
+        self._documents[product_id] = (length, tuple(frequencies))
+        self._total_length += length
+
+    def _discard(self, product_id):
+        document = self._documents.pop(product_id, None)
+        if document is None:
+            return
+        length, terms = document
+        self._total_length -= length
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(product_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def _patch(self, product):
+        with self._lock:
+            if self._built:
+                self._discard(product.pk)
+                self._add(product.pk, product.title, product.description)
+
+    def index(self, product):
+        self._patch(product)
+        self._publish([product.pk])
+
+    def index_many(self, products):
+        for product in products:
+            self._patch(product)
+        self._publish([product.pk for product in products])
+
+    def remove(self, product_id):
+        with self._lock:
+            self._discard(product_id)
+        self._publish([product_id])
+
+    def rebuild(self, batch_size=2000):
+        with self._lock:
+            # Read first: changes published during the scan are replayed again, harmlessly.
+            self._generation = get_search_generation()
+            self._postings = defaultdict(dict)
+            self._documents = {}
+            self._total_length = 0
+            rows = Product.objects.values_list('id', 'title', 'description')
+            for product_id, title, description in rows.iterator(chunk_size=batch_size):
+                self._add(product_id, title, description)
+            self._built = True
+
+    def search(self, query, limit, offset=0):
+        terms = set(tokenize(query))
+        with self._lock:
+            self._ensure_built()
+            postings = [self._postings.get(term) for term in terms]
+            if not postings or not all(postings):
+                return []
+            postings.sort(key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+            documents = len(self._documents)
+            average_length = self._total_length / documents
+            scores = {}
+            for product_id in candidates:
+                length = self._documents[product_id][0]
+                score = 0
+                for term_postings in postings:
+                    frequency = term_postings[product_id]
+                    idf = math.log(1 + (documents - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+                    norm = frequency + self.k1 * (1 - self.b + self.b * length / average_length)
+                    score += idf * frequency * (self.k1 + 1) / norm
+                scores[product_id] = score
+        ranked = sorted(scores, key=lambda product_id: (-scores[product_id], product_id))
+        return ranked[offset:offset + limit]
+
+
+_indexes = {}
+
+
+def fts5_available():
+    if connection.vendor != 'sqlite':
+        return False
+    return FTS_TABLE in connection.introspection.table_names()
+
+
+def get_search_index():
+    backend = getattr(settings, 'SEARCH_BACKEND', None)
+    if backend is None:
+        if 'auto' not in _indexes:
+            _indexes['auto'] = SqliteFTSIndex() if fts5_available() else InvertedIndex()
+        return _indexes['auto']
+    if backend not in _indexes:
+        _indexes[backend] = SqliteFTSIndex() if backend == 'fts5' else InvertedIndex()
+    return _indexes[backend]
+
+
+def search_products(query, page=1, per_page=24, queryset=None):
+    """Ranked products for ``query`` plus whether another page follows."""
+    queryset = Product.objects.all() if queryset is None else queryset
+    product_ids = get_search_index().search(query, per_page + 1, (page - 1) * per_page)
+    has_next = len(product_ids) > per_page
+    product_ids = product_ids[:per_page]
+    products = queryset.in_bulk(product_ids)
+    return [products[product_id] for product_id in product_ids if product_id in products], has_next
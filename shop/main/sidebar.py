@@ -0,0 +1,60 @@
+import time
+
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Category, get_models_for_count
+
+
+SIDEBAR_CACHE_KEY = 'main:sidebar:categories:v2'
+SIDEBAR_CHANGED_KEY = 'main:sidebar:changed_at'
+SIDEBAR_CACHE_TIMEOUT = 60 * 60
+SIDEBAR_LOCAL_TTL = 5
+
+# Per-process copy in front of the shared cache: (expires_at, categories).
+_local_cache = None
+
+
+def build_sidebar_categories():
+    categories = Category.objects.annotate(
+        *get_models_for_count('product')
+    ).values('name', 'slug', 'product__count').order_by('id')
+    return [
+        {
+            'name': category['name'],
+            'slug': category['slug'],
+            'url': reverse('category_detail', kwargs={'slug': category['slug']}),
+            'count': category['product__count'],
+        }
+        for category in categories
+    ]
+
+
+def get_sidebar_categories():
+    global _local_cache
+    now = time.monotonic()
+    if _local_cache is not None and _local_cache[0] > now:
+        return _local_cache[1]
+    categories = cache.get(SIDEBAR_CACHE_KEY)
+    if categories is None:
+        categories = build_sidebar_categories()
+        cache.set(SIDEBAR_CACHE_KEY, categories, SIDEBAR_CACHE_TIMEOUT)
+    _local_cache = (now + SIDEBAR_LOCAL_TTL, categories)
+    return categories
+
+
+def get_sidebar_changed_at():
+    # Unknown after a cache flush, so assume it just changed.
+    changed_at = cache.get(SIDEBAR_CHANGED_KEY)
+    if changed_at is None:
+        changed_at = timezone.now()
+        cache.add(SIDEBAR_CHANGED_KEY, changed_at, None)
+    return changed_at
+
+
+def invalidate_sidebar_categories():
+    global _local_cache
+    _local_cache = None
+    cache.delete(SIDEBAR_CACHE_KEY)
+    cache.set(SIDEBAR_CHANGED_KEY, timezone.now(), None)
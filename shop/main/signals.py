@@ -0,0 +1,75 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .images import derivatives_job
+from .jobs import enqueue
+from .models import Category, Product
+from .page_cache import bump_catalog_version
+from .product_cache import product_cache
+from .search import get_search_index
+from .sidebar import invalidate_sidebar_categories
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def catalog_changed(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_lookup_changed(sender, instance, **kwargs):
+    product_cache.invalidate(*{instance.slug, getattr(instance, '_loaded_slug', None)} - {None})
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Product)
+def sidebar_changed(sender, **kwargs):
+    invalidate_sidebar_categories()
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, raw=False, **kwargs):
+    category_ids = {instance.category_id, getattr(instance, '_loaded_category_id', None)} - {None}
+    if created or len(category_ids) > 1:
+        invalidate_sidebar_categories()
+    if not raw:
+        Category.objects.filter(pk__in=category_ids).update(catalog_updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    Category.objects.filter(pk=instance.category_id).update(catalog_updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Product)
+def product_image_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if instance.image and not instance.has_derivatives:
+        enqueue('build_product_derivatives', *derivatives_job(instance))
+    # Still the name loaded from the database; Product.save updates it after the signals.
+    old_image_name = getattr(instance, '_loaded_image_name', None)
+    if old_image_name and old_image_name != instance.image.name:
+        enqueue('delete_product_derivatives', {'image_name': old_image_name})
+
+
+@receiver(post_delete, sender=Product)
+def product_image_deleted(sender, instance, **kwargs):
+    if instance.image:
+        enqueue('delete_product_derivatives', {'image_name': instance.image.name})
+
+
+@receiver(post_save, sender=Product)
+def product_search_indexed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        get_search_index().index(instance)
+
+
+@receiver(post_delete, sender=Product)
+def product_search_removed(sender, instance, **kwargs):
+    get_search_index().remove(instance.pk)
@@ -0,0 +1,42 @@
+from django import template
+from django.utils.html import format_html
+
+from main.images import PRODUCT_IMAGE_SIZES, derivative_name
+
+
+register = template.Library()
+
+
+def _srcset(product, size, extension):
+    # Derivatives are never upscaled, so a small source has narrower files than their names say.
+    storage = product.image.storage
+    candidates = {}
+    for width in PRODUCT_IMAGE_SIZES[size]:
+        candidates.setdefault(min(width, product.image_width or width), width)
+    return ', '.join(
+        f'{storage.url(derivative_name(product.image.name, width, extension))} {actual}w'
+        for actual, width in candidates.items()
+    )
+
+
+@register.simple_tag
+def product_picture(product, size, css_class='', style='', alt=''):
+    """
+    ``<picture>`` for a product image at one of ``PRODUCT_IMAGE_SIZES``,
+    with a WebP source and a JPEG fallback. Falls back to the original
+    upload until the derivatives have been generated.
+    """
+    if not product.image:
+        return ''
+    if not product.has_derivatives:
+        return format_html('<img class="{}" style="{}" src="{}" alt="{}">', css_class, style, product.image.url, alt)
+
+    smallest = PRODUCT_IMAGE_SIZES[size][0]
+    sizes = f'{smallest}px'
+    fallback = product.image.storage.url(derivative_name(product.image.name, smallest, 'jpg'))
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img class="{}" style="{}" src="{}" srcset="{}" sizes="{}" alt="{}"></picture>',
+        _srcset(product, size, 'webp'), sizes,
+        css_class, style, fallback, _srcset(product, size, 'jpg'), sizes, alt
+    )
@@ -0,0 +1,24 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class ShopTestRunner(DiscoverRunner):
+    """
+    Runs the tests against a private in-memory cache, so ``cache.clear()``
+    in tests never touches a cache shared with running servers, and with
+    request sampling off; tests that time requests opt in with
+    override_settings.
+    """
+
+    test_settings = override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        PERF_SAMPLE_RATE=0,
+    )
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,40 +1,103 @@
+import json
+import os
+import re
+import tempfile
+from datetime import timedelta
 from decimal import Decimal
 from unittest import mock
-from django.test import TestCase, RequestFactory
+import threading
+import time
+from django.test import TestCase, TransactionTestCase, RequestFactory, AsyncClient, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import OperationalError, close_old_connections, connection, connections, transaction
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, HttpResponse
+from asgiref.sync import async_to_sync
+from django.contrib.sessions.backends.cache import SessionStore
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from io import BytesIO, StringIO
+from PIL import Image
+from django.template import Context, Template
 
-from .models import Category, Notebook, Cart, CartProduct, Customer
-from .views import recalc_cart, AddToCartView, BaseView
+from .models import Category, Product, Cart, CartProduct, Customer, Job, Order
+from . import jobs
+from .admin import ProductAdminForm
+from .cart_cleanup import archive_carts, prune_carts, prune_carts_task, schedule_prune_carts
+from .checkout import CheckoutError, place_order
+from .db_router import ReplicaRoutingMiddleware, check_shared_cache
+from .images import derivative_name, derivative_widths
+from .instrumentation import get_stats, reset_stats
+from .query_budget import QueryBudgetExceeded, query_budget
+from .page_cache import CATALOG_VERSION_KEY, bump_catalog_version, get_catalog_version
+from .product_cache import PRODUCT_CACHE_FIELDS, product_cache
+from .reports import ORDER_EXPORT_FIELDS, iter_order_rows
+from .search import InvertedIndex, get_search_index, search_products
+from .facets import price_facets
+from .sidebar import get_sidebar_categories, invalidate_sidebar_categories
+from .mixins import CART_SESSION_KEY, CartMixin
+from .utils import (
+    CartOperationError, add_cart_product, apply_cart_operations, change_cart_product_qty, recalc_cart,
+    remove_cart_product, verify_cart_totals
+)
+from .forms import CatalogFilterForm
+from .async_views import AsyncBaseView, AsyncCartView, AsyncCategoryDetailView, AsyncProductDetailView
+from .views import AddToCartView, BaseView, CartView, CategoryDetailView, ProductDetailView
 
 
 User = get_user_model()
 
+
+def make_image(name='product.png', size=(500, 500)):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'orange').save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+def make_products(category, count, start=0):
+    Product.objects.bulk_create([
+        Product(
+            category=category,
+            title=f'Product {i}',
+            slug=f'{category.slug}-product-{i}',
+            image=f'product-{i}.jpg',
+            description='Description',
+            price=Decimal('10.00') + i
+        )
+        for i in range(start, start + count)
+    ])
+    slugs = [f'{category.slug}-product-{i}' for i in range(start, start + count)]
+    return list(Product.objects.filter(slug__in=slugs).order_by('id'))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
 class ShopTestCases(TestCase):
 
     def setUp(self) -> None:
+        cache.clear()
+        product_cache.clear()
         self.user = User.objects.create(username='testuser', password='password')
         self.category = Category.objects.create(name='Notebooks', slug='notebooks')
         image = SimpleUploadedFile("notebook_image.jpg", content=b'', content_type="image/jpg")
 
-        self.notebook = Notebook.objects.create(
+        self.notebook = Product.objects.create(
             category = self.category,
             title = 'Test Notebook',
             slug = 'test-notebook',
             image = image,
             price = Decimal('2500.00'),
-            size = '13.0',
-            processor = '3.6',
-            memory = '16',
-            video = '1600',
-            battery_life = '5000'
         )
         self.customer = Customer.objects.create(user=self.user, phone='2223344', address='Street')
         self.cart = Cart.objects.create(owner=self.customer)
         self.cart_product = CartProduct.objects.create(
             user=self.customer,
             cart=self.cart,
-            content_object=self.notebook
+            product=self.notebook
         )
 
     def test_add_to_cart(self):
@@ -51,7 +114,8 @@ class ShopTestCases(TestCase):
         factory = RequestFactory()
         request = factory.get('')
         request.user = self.user
-        response = AddToCartView.as_view()(request, ct_model='notebook', slug='test-notebook')
+        request.session = SessionStore()
+        response = AddToCartView.as_view()(request, slug='test-notebook')
 
         self.assertEqual(response.status_code, 302)
         self.assertEqual(response.url, '/cart/')
@@ -63,6 +127,1621 @@ class ShopTestCases(TestCase):
             factory = RequestFactory()
             request = factory.get('')
             request.user = self.user
+            request.session = SessionStore()
             response = BaseView.as_view()(request)
             self.assertEqual(response.status_code, 444)
 
+
+class CatalogPaginationTestCases(TestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(username='testuser', password='password')
+        self.category = Category.objects.create(name='Notebooks', slug='notebooks')
+        self.customer = Customer.objects.create(user=self.user)
+        self.cart = Cart.objects.create(owner=self.customer)
+
+    def count_queries(self, url):
+        self.client.force_login(self.user)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_home_page_is_bounded(self):
+        make_products(self.category, 30)
+        response, small_catalog_queries = self.count_queries(reverse('base'))
+        self.assertEqual(len(response.context['products']), BaseView.paginate_by)
+        self.assertEqual(len(response.context['carousel_products']), BaseView.carousel_size)
+
+        make_products(self.category, 300, start=30)
+        response, large_catalog_queries = self.count_queries(reverse('base'))
+        self.assertEqual(len(response.context['products']), BaseView.paginate_by)
+        self.assertEqual(small_catalog_queries, large_catalog_queries)
+
+    def test_category_page_is_bounded(self):
+        url = reverse('category_detail', kwargs={'slug': self.category.slug})
+        make_products(self.category, 30)
+        response, small_catalog_queries = self.count_queries(url)
+        self.assertEqual(len(response.context['category_products']), CategoryDetailView.paginate_by)
+
+        make_products(self.category, 300, start=30)
+        response, large_catalog_queries = self.count_queries(url)
+        self.assertEqual(len(response.context['category_products']), CategoryDetailView.paginate_by)
+        self.assertEqual(small_catalog_queries, large_catalog_queries)
+
+    def test_keyset_pages_cover_catalog_once(self):
+        make_products(self.category, 60)
+        self.client.force_login(self.user)
+        seen = []
+        url = reverse('base')
+        while url:
+            page = self.client.get(url).context['page']
+            seen.extend(product.id for product in page)
+            url = f"{reverse('base')}?after={page.next_cursor}" if page.has_next else None
+        self.assertEqual(seen, list(Product.objects.order_by('id').values_list('id', flat=True)))
+
+        previous = self.client.get(f"{reverse('base')}?before={page.previous_cursor}").context['page']
+        self.assertEqual(len(previous), BaseView.paginate_by)
+        self.assertEqual(previous.object_list[-1].id, page.object_list[0].id - 1)
+
+
+class SidebarTestCases(TestCase):
+
+    def setUp(self) -> None:
+        invalidate_sidebar_categories()
+        self.notebooks = Category.objects.create(name='Notebooks', slug='notebooks')
+        self.phones = Category.objects.create(name='Smartphones', slug='smartphones')
+        make_products(self.notebooks, 3)
+        make_products(self.phones, 2)
+
+    def tearDown(self) -> None:
+        invalidate_sidebar_categories()
+
+    def test_counts_in_one_query(self):
+        invalidate_sidebar_categories()
+        with self.assertNumQueries(1):
+            categories = get_sidebar_categories()
+        self.assertEqual(categories, [
+            {'name': 'Notebooks', 'slug': 'notebooks', 'url': '/category/notebooks', 'count': 3},
+            {'name': 'Smartphones', 'slug': 'smartphones', 'url': '/category/smartphones', 'count': 2},
+        ])
+
+    def test_warm_hit_costs_no_queries(self):
+        get_sidebar_categories()
+        with self.assertNumQueries(0):
+            get_sidebar_categories()
+
+    def test_invalidated_on_catalog_change(self):
+        get_sidebar_categories()
+        Product.objects.filter(category=self.phones).first().delete()
+        self.assertEqual(get_sidebar_categories()[1]['count'], 1)
+
+        Category.objects.create(name='Tablets', slug='tablets')
+        self.assertEqual([c['name'] for c in get_sidebar_categories()], ['Notebooks', 'Smartphones', 'Tablets'])
+
+
+class CartResolutionTestCases(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        product_cache.clear()
+        self.user = User.objects.create(username='testuser', password='password')
+        self.category = Category.objects.create(name='Notebooks', slug='notebooks')
+        self.product = make_products(self.category, 1)[0]
+
+    def resolve(self, user, session):
+        request = RequestFactory().get('/')
+        request.user = user
+        request.session = session
+        return CartMixin().resolve_cart(request)
+
+    def test_hot_path_is_one_query(self):
+        customer = Customer.objects.create(user=self.user)
+        cart = Cart.objects.create(owner=customer)
+        session = SessionStore()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.resolve(self.user, session), cart)
+        self.assertEqual(session[CART_SESSION_KEY], cart.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.resolve(self.user, session), cart)
+
+    def test_browsing_creates_no_carts(self):
+        self.client.get(reverse('base'))
+        self.client.get(reverse('cart'))
+        self.client.force_login(self.user)
+        self.client.get(reverse('base'))
+        self.assertFalse(Cart.objects.exists())
+
+    def test_anonymous_visitors_get_own_carts(self):
+        first, second = Client(), Client()
+        first.get(reverse('add_to_cart', kwargs={'slug': self.product.slug}))
+        second.get(reverse('add_to_cart', kwargs={'slug': self.product.slug}))
+        first.get(reverse('add_to_cart', kwargs={'slug': self.product.slug}))
+
+        self.assertEqual(Cart.objects.filter(for_anonymous_user=True).count(), 2)
+        self.assertNotEqual(first.session[CART_SESSION_KEY], second.session[CART_SESSION_KEY])
+        self.assertEqual(first.get(reverse('cart')).context['cart'].pk, first.session[CART_SESSION_KEY])
+
+    def test_anonymous_cart_adopted_on_login(self):
+        self.client.get(reverse('add_to_cart', kwargs={'slug': self.product.slug}))
+        cart_id = self.client.session[CART_SESSION_KEY]
+        self.client.force_login(self.user)
+        self.client.get(reverse('add_to_cart', kwargs={'slug': self.product.slug}))
+
+        cart = Cart.objects.get(pk=cart_id)
+        self.assertEqual(cart.owner.user, self.user)
+        self.assertFalse(cart.for_anonymous_user)
+        self.assertEqual(cart.related_products.get().user, cart.owner)
+
+
+class CartTotalsTestCases(TestCase):
+
+    def setUp(self) -> None:
+        self.category = Category.objects.create(name='Notebooks', slug='notebooks')
+        self.products = make_products(self.category, 30)
+        self.cart = Cart.objects.create()
+
+    def count_updates(self, func, *args):
+        with CaptureQueriesContext(connection) as queries:
+            func(*args)
+        return sum(1 for query in queries if query['sql'].startswith('UPDATE'))
+
+    def test_totals_follow_mutations(self):
+        first, second = self.products[:2]
+        add_cart_product(self.cart, first)
+        add_cart_product(self.cart, second)
+        add_cart_product(self.cart, second)
+        change_cart_product_qty(self.cart, first, 3)
+        remove_cart_product(self.cart, second)
+
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_products, 1)
+        self.assertEqual(self.cart.final_price, first.price * 3)
+        self.assertTrue(verify_cart_totals(self.cart))
+
+    def test_update_count_independent_of_cart_size(self):
+        for product in self.products[:-1]:
+            add_cart_product(self.cart, product)
+        last = self.products[-1]
+        self.assertEqual(self.count_updates(add_cart_product, self.cart, last), 1)
+        self.assertEqual(self.count_updates(change_cart_product_qty, self.cart, last, 5), 2)
+        self.assertEqual(self.count_updates(remove_cart_product, self.cart, last), 1)
+
+    def test_stale_instances_do_not_lose_updates(self):
+        first_tab = Cart.objects.get(pk=self.cart.pk)
+        second_tab = Cart.objects.get(pk=self.cart.pk)
+        add_cart_product(first_tab, self.products[0])
+        add_cart_product(second_tab, self.products[1])
+
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_products, 2)
+        self.assertTrue(verify_cart_totals(self.cart))
+
+    def test_verify_and_repair(self):
+        add_cart_product(self.cart, self.products[0])
+        Cart.objects.filter(pk=self.cart.pk).update(total_products=7, final_price=0)
+        self.cart.refresh_from_db()
+
+        out = StringIO()
+        call_command('check_cart_totals', stdout=out)
+        self.assertIn('1 drifted carts found', out.getvalue())
+        self.assertFalse(verify_cart_totals(self.cart, repair=True))
+        self.assertTrue(verify_cart_totals(self.cart))
+
+        Cart.objects.filter(pk=self.cart.pk).update(total_products=7)
+        call_command('check_cart_totals', '--repair', stdout=StringIO())
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_products, 1)
+
+
+class CartPageTestCases(TestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(username='testuser', password='password')
+        self.category = Category.objects.create(name='Notebooks', slug='notebooks')
+        self.products = make_products(self.category, 100)
+        self.customer = Customer.objects.create(user=self.user)
+        self.cart = Cart.objects.create(owner=self.customer)
+        self.client.force_login(self.user)
+
+    def count_queries(self, url):
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_cart_pages_have_constant_queries(self):
+        add_cart_product(self.cart, self.products[0])
+        one_line = {name: self.count_queries(reverse(name))[1] for name in ('cart', 'checkout')}
+
+        for product in self.products[1:]:
+            add_cart_product(self.cart, product)
+        for name in ('cart', 'checkout'):
+            response, queries = self.count_queries(reverse(name))
+            self.assertEqual(response.context['cart_contents'].count, 100)
+            self.assertContains(response, self.products[-1].title)
+            self.assertEqual(queries, one_line[name])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ProductImageTestCases(TestCase):
+
+    def setUp(self) -> None:
+        self.category = Category.objects.create(name='Notebooks', slug='notebooks')
+
+    def create_product(self, image):
+        return Product.objects.create(
+            category=self.category, title='Notebook', slug='notebook', image=image, price=Decimal('10.00')
+        )
+
+    def test_derivatives_generated_on_save(self):
+        product = self.create_product(make_image(size=(1000, 800)))
+        storage = product.image.storage
+        self.assertFalse(Product.objects.get(pk=product.pk).has_derivatives)
+        self.assertEqual(jobs.drain(), 1)
+        self.assertTrue(Product.objects.get(pk=product.pk).has_derivatives)
+        for width in derivative_widths():
+            for extension in ('jpg', 'webp'):
+                self.assertTrue(storage.exists(derivative_name(product.image.name, width, extension)))
+        with storage.open(derivative_name(product.image.name, 200, 'webp')) as derivative:
+            self.assertEqual(Image.open(derivative).size, (200, 160))
+
+        product.delete()
+        jobs.drain()
+        self.assertFalse(storage.exists(derivative_name(product.image.name, 200, 'webp')))
+
+    def test_unreadable_image_serves_original(self):
+        product = self.create_product(SimpleUploadedFile('broken.jpg', b'', content_type='image/jpg'))
+        with self.assertLogs('main.images', 'WARNING') as logs:
+            jobs.drain()
+        self.assertIn('Cannot build derivatives', logs.output[0])
+        self.assertFalse(Product.objects.get(pk=product.pk).has_derivatives)
+        html = Template("{% load product_images %}{% product_picture product 'card' %}").render(Context({'product': product}))
+        self.assertIn(product.image.url, html)
+        self.assertNotIn('srcset', html)
+
+    def test_image_uploaded_again_under_same_name_is_rebuilt(self):
+        product = self.create_product(SimpleUploadedFile('broken.jpg', b'', content_type='image/jpg'))
+        with self.assertLogs('main.images', 'WARNING'):
+            jobs.drain()
+        storage = product.image.storage
+        storage.delete(product.image.name)
+        storage.save(product.image.name, make_image(size=(1000, 800)))
+        product.save()
+        self.assertEqual(jobs.drain(), 1)
+        self.assertTrue(Product.objects.get(pk=product.pk).has_derivatives)
+
+    def test_picture_tag_emits_srcset(self):
+        product = self.create_product(make_image())
+        jobs.drain()
+        product.refresh_from_db()
+        html = Template("{% load product_images %}{% product_picture product 'card' alt='x' %}").render(Context({'product': product}))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('-200w.webp 200w', html)
+        self.assertIn('-400w.jpg 400w', html)
+
+    def test_srcset_describes_encoded_widths(self):
+        product = self.create_product(make_image(size=(300, 300)))
+        jobs.drain()
+        product.refresh_from_db()
+        self.assertEqual(product.image_width, 300)
+        html = Template("{% load product_images %}{% product_picture product 'card' %}").render(Context({'product': product}))
+        self.assertIn('-200w.jpg 200w, ', html)
+        self.assertIn('-400w.jpg 300w"', html)
+        html = Template("{% load product_images %}{% product_picture product 'detail' %}").render(Context({'product': product}))
+        self.assertIn('-600w.webp 300w"', html)
+        self.assertNotIn('1200w', html)
+
+    def test_replaced_image_derivatives_deleted(self):
+        product = self.create_product(make_image('first.png'))
+        jobs.drain()
+        old_derivative = derivative_name(Product.objects.get(pk=product.pk).image.name, 200, 'webp')
+        storage = product.image.storage
+        self.assertTrue(storage.exists(old_derivative))
+        product = Product.objects.get(pk=product.pk)
+        product.image = make_image('second.png')
+        product.save()
+        jobs.drain()
+        self.assertFalse(storage.exists(old_derivative))
+        self.assertTrue(storage.exists(derivative_name(product.image.name, 200, 'webp')))
+
+    def test_derivatives_refresh_page_validators(self):
+        cache.clear()
+        product = self.create_product(make_image())
+        urls = [reverse('product_detail', kwargs={'slug': product.slug}),
+                reverse('category_detail', kwargs={'slug': self.category.slug})]
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        jobs.drain()
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            self.assertContains(response, 'srcset')
+
+    def test_min_resolution_enforced_on_validation(self):
+        data = {'category': self.category.pk, 'title': 'Notebook', 'slug': 'notebook', 'description': 'x', 'price': '10.00'}
+        form = ProductAdminForm(data, {'image': make_image(size=(300, 500))}, instance=Product())
+        self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
+
+        form = ProductAdminForm(data, {'image': make_image(size=(400, 400))}, instance=Product())
+        self.assertTrue(form.is_valid(), form.errors)
+
+        product = Product(category=self.category, title='Notebook', slug='other', price=Decimal('1.00'))
+        product.image = make_image(size=(300, 500))
+        with self.assertRaises(ValidationError):
+            product.full_clean()
+
+
+FLAKY_CALLS = {}
+
+
+@jobs.task('test_flaky')
+def flaky_task(fail_times, counter_key):
+    FLAKY_CALLS[counter_key] = FLAKY_CALLS.get(counter_key, 0) + 1
+    if FLAKY_CALLS[counter_key] <= fail_times:
+        raise RuntimeError('try again')
+
+
+@override_settings(JOBS_RETRY_DELAY=0)
+class JobQueueTestCases(TestCase):
+
+    def test_keys_are_idempotent(self):
+        first = jobs.enqueue('test_flaky', {'fail_times': 0, 'counter_key': 'idempotent'}, key='same')
+        second = jobs.enqueue('test_flaky', {'fail_times': 0, 'counter_key': 'idempotent'}, key='same')
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(jobs.drain(), 1)
+        self.assertEqual(jobs.drain(), 0)
+        self.assertEqual(FLAKY_CALLS['idempotent'], 1)
+
+    def test_retries_until_success(self):
+        job = jobs.enqueue('test_flaky', {'fail_times': 2, 'counter_key': 'retry'})
+        with self.assertLogs('main.jobs', 'WARNING') as logs:
+            for _ in range(3):
+                jobs.drain()
+        self.assertEqual(len(logs.output), 2)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_DONE)
+        self.assertEqual(job.attempts, 3)
+
+    def test_gives_up_after_max_attempts(self):
+        job = jobs.enqueue('test_flaky', {'fail_times': 5, 'counter_key': 'fail'}, max_attempts=2)
+        with self.assertLogs('main.jobs', 'WARNING') as logs:
+            call_command('drain_jobs', stdout=StringIO())
+        self.assertIn('failed on attempt 2', logs.output[-1])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertIn('try again', job.last_error)
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = jobs.enqueue('test_flaky', {'fail_times': 0, 'counter_key': 'stale'})
+        Job.objects.filter(pk=job.pk).update(status=Job.STATUS_RUNNING)
+        out = StringIO()
+        call_command('drain_jobs', '--stale-after', '-1', stdout=out)
+        self.assertIn('Requeued 1 stale jobs', out.getvalue())
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.STATUS_DONE)
+
+
+class AnonymousPageCacheTestCases(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        product_cache.clear()
+        self.user = User.objects.create(username='testuser', password='password')
+        self.category = Category.objects.create(name='Notebooks', slug='notebooks')
+        self.product = make_products(self.category, 3)[0]
+        self.urls = [
+            reverse('base'),
+            reverse('category_detail', kwargs={'slug': self.category.slug}),
+            reverse('product_detail', kwargs={'slug': self.product.slug}),
+        ]
+
+    def test_warm_anonymous_pages_skip_database(self):
+        for url in self.urls:
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(first.content, second.content)
+            self.assertContains(second, 'data-cart-badge="/cart/badge/"')
+
+    def test_anonymous_visitor_with_cart_reads_cached_page(self):
+        self.client.get(reverse('add_to_cart', kwargs={'slug': self.product.slug}))
+        self.client.get(reverse('base'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('base'))
+        self.assertEqual(self.client.get(reverse('cart_badge')).json(), {'total_products': 1})
+
+    def test_catalog_change_invalidates_pages(self):
+        self.client.get(reverse('base'))
+        Product.objects.filter(pk=self.product.pk).first().save()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('base'))
+        self.assertTrue(queries)
+
+    def test_authenticated_pages_are_not_cached(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('base'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('base'))
+        self.assertTrue(queries)
+        self.assertNotContains(response, 'data-cart-badge="')
+
+    def test_unknown_params_bypass_cache(self):
+        url = self.urls[1]
+        self.client.get(url, {'sort': 'price', 'utm_source': 'mail'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'sort': 'price'})
+        self.assertTrue(queries)
+        self.assertNotContains(response, 'utm_source')
+        with self.assertNumQueries(0):
+            self.client.get(url, {'sort': 'price'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'sort': 'price', 'junk': '1'})
+        self.assertTrue(queries)
+
+    @override_settings(PAGE_CACHE=False)
+    def test_page_cache_can_be_disabled(self):
+        self.client.get(self.urls[0])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.urls[0])
+        self.assertTrue(queries)
+
+    def test_evicted_catalog_version_does_not_restart(self):
+        version = get_catalog_version()
+        bump_catalog_version()
+        cache.delete(CATALOG_VERSION_KEY)
+        self.assertGreater(get_catalog_version(), version + 1)
+
+
+class ConditionalPageTestCases(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.category = Category.objects.create(name='Notebooks', slug='notebooks')
+        self.product = make_products(self.category, 3)[0]
+        self.product_url = reverse('product_detail', kwargs={'slug': self.product.slug})
+        self.category_url = reverse('category_detail', kwargs={'slug': self.category.slug})
+
+    def test_not_modified_from_one_lookup(self):
+        for url in (self.product_url, self.category_url):
+            etag = self.client.get(url)['ETag']
+            bump_catalog_version()
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+
+    def test_not_modified_from_cached_page(self):
+        response = self.client.get(self.product_url)
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.product_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_product_change_refreshes_validators(self):
+        product_etag = self.client.get(self.product_url)['ETag']
+        category_etag = self.client.get(self.category_url)['ETag']
+        other = Product.objects.get(pk=self.product.pk + 1)
+        other.price += 1
+        other.save()
+
+        self.assertEqual(self.client.get(self.product_url, HTTP_IF_NONE_MATCH=product_etag).status_code, 304)
+        response = self.client.get(self.category_url, HTTP_IF_NONE_MATCH=category_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], category_etag)
+
+    def test_unknown_slug_is_404(self):
+        self.assertEqual(self.client.get(reverse('product_detail', kwargs={'slug': 'missing'})).status_code, 404)
+
+
+class SearchTestMixin:
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.category = Category.objects.create(name='Notebooks', slug='notebooks')
+        make_products(self.category, 40)
+        Product.objects.filter(title='Product 7').update(title='Gaming laptop', description='Fast machine')
+        Product.objects.filter(title='Product 8').update(description='Works with any gaming laptop bag')
+        get_search_index().rebuild()
+
+    def search_titles(self, query, page=1, per_page=24):
+        products, has_next = search_products(query, page, per_page)
+        return [product.title for product in products], has_next
+
+    def test_ranked_results(self):
+        titles, _ = self.search_titles('Laptop GAMING')
+        self.assertEqual(titles, ['Gaming laptop', 'Product 8'])
+        self.assertEqual(self.search_titles('laptop missing')[0], [])
+        self.assertEqual(self.search_titles('"*')[0], [])
+
+    def test_paginated_results(self):
+        first, has_next = self.search_titles('product', per_page=30)
+        second, has_more = self.search_titles('product', page=2, per_page=30)
+        self.assertEqual((len(first), has_next, len(second), has_more), (30, True, 9, False))
+        self.assertFalse(set(first) & set(second))
+
+    def test_index_follows_signals(self):
+        product = Product.objects.create(
+            category=self.category, title='Ultrabook', slug='ultrabook', image='u.jpg', price=Decimal('1.00')
+        )
+        self.assertEqual(self.search_titles('ultrabook')[0], ['Ultrabook'])
+        product.title = 'Netbook'
+        product.save()
+        self.assertEqual(self.search_titles('ultrabook')[0], [])
+        product.delete()
+        self.assertEqual(self.search_titles('netbook')[0], [])
+
+    def test_search_view(self):
+        response = self.client.get(reverse('search'), {'q': 'gaming'})
+        self.assertEqual([product.title for product in response.context['products']], ['Gaming laptop', 'Product 8'])
+        self.assertContains(response, 'Search results for')
+
+
+@override_settings(SEARCH_BACKEND='fts5')
+class SqliteSearchTestCases(SearchTestMixin, TestCase):
+    pass
+
+
+@override_settings(SEARCH_BACKEND='python')
+class InvertedIndexSearchTestCases(SearchTestMixin, TestCase):
+
+    def test_changes_from_other_processes_are_replayed(self):
+        other_process = InvertedIndex()
+        other_process.search('product', 1)
+        product = Product.objects.get(title='Product 3')
+        with mock.patch('main.search.transaction.on_commit') as on_commit:
+            product.title = 'Ultrabook'
+            product.save()
+        self.assertEqual(other_process.search('ultrabook', 10), [])
+        for callback, in (call.args for call in on_commit.call_args_list):
+            callback()
+        with mock.patch.object(other_process, 'rebuild') as rebuild:
+            self.assertEqual(other_process.search('ultrabook', 10), [product.pk])
+        rebuild.assert_not_called()
+
+    def test_rebuilt_when_change_log_is_lost(self):
+        other_process = InvertedIndex()
+        other_process.search('product', 1)
+        # A bulk write without signals, then the shared cache loses the log.
+        Product.objects.filter(title='Product 3').update(title='Ultrabook')
+        cache.clear()
+        self.assertEqual(other_process.search('ultrabook', 10), [Product.objects.get(title='Ultrabook').pk])
+
+
+class CategoryFilterTestCases(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.category = Category.objects.create(name='Notebooks', slug='notebooks')
+        self.products = make_products(self.category, 60)
+        # Duplicate prices so keyset pages must break ties on id.
+        Product.objects.filter(pk__in=[p.pk for p in self.products[::2]]).update(price=Decimal('150.00'))
+        self.url = reverse('category_detail', kwargs={'slug': self.category.slug})
+
+    def walk(self, params):
+        ids, response = [], self.client.get(self.url, params)
+        while True:
+            page = response.context['page']
+            ids.extend(product.id for product in page)
+            if not page.has_next:
+                return ids, response
+            self.assertIn(f'after={page.next_cursor}', response.content.decode())
+            response = self.client.get(self.url, {**params, 'after': page.next_cursor})
+
+    def test_price_filter_and_sort(self):
+        ids, _ = self.walk({'min_price': '20', 'max_price': '200', 'sort': 'price'})
+        expected = Product.objects.filter(price__gte=20, price__lt=200).order_by('price', 'id')
+        self.assertEqual(ids, list(expected.values_list('id', flat=True)))
+
+        ids, _ = self.walk({'sort': '-price'})
+        self.assertEqual(ids, list(Product.objects.order_by('-price', '-id').values_list('id', flat=True)))
+
+    def test_newest_sort(self):
+        Product.objects.filter(pk=self.products[5].pk).update(created_at=timezone.now() + timedelta(days=1))
+        response = self.client.get(self.url, {'sort': 'newest'})
+        self.assertEqual(response.context['page'].object_list[0].pk, self.products[5].pk)
+
+    def test_invalid_filters_are_ignored(self):
+        response = self.client.get(self.url, {'min_price': 'cheap', 'sort': 'random'})
+        self.assertEqual(len(response.context['page']), CategoryDetailView.paginate_by)
+
+    def test_price_facets_in_one_query(self):
+        with self.assertNumQueries(1):
+            facets = price_facets(Product.objects.filter(category=self.category))
+        self.assertEqual([facet['count'] for facet in facets], [30, 30, 0, 0, 0])
+        response = self.client.get(self.url)
+        self.assertContains(response, 'href="?min_price=0&amp;max_price=100"')
+
+    def test_filtered_listing_uses_composite_index(self):
+        form = CatalogFilterForm({'min_price': '10', 'max_price': '90', 'sort': 'price'})
+        queryset = form.filter_queryset(Product.objects.filter(category=self.category))
+        queryset = queryset.order_by(*form.get_ordering())[:25]
+        plan = queryset.explain()
+        self.assertIn('product_category_price_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class CatalogImportExportTestCases(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.tmp = tempfile.mkdtemp()
+
+    def write_file(self, name, content):
+        path = f'{self.tmp}/{name}'
+        with open(path, 'w') as stream:
+            stream.write(content)
+        return path
+
+    def test_csv_upsert_by_slug(self):
+        path = self.write_file('catalog.csv', (
+            'category_slug,category_name,slug,title,description,price,image\n'
+            'notebooks,Notebooks,nb-1,Notebook 1,Light,100.5,nb-1.jpg\n'
+            'notebooks,Notebooks,nb-2,Notebook 2,,200,nb-2.jpg\n'
+            'phones,Phones,ph-1,Phone 1,Small,50,ph-1.jpg\n'
+            'phones,Phones,ph-2,Phone 2,Broken,not-a-price,ph-2.jpg\n'
+        ))
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', path, '--batch-size', '2', stdout=out, stderr=err)
+        self.assertIn('3 created, 0 updated, 1 skipped, 2 categories', out.getvalue())
+        self.assertIn('Row 4: invalid price', err.getvalue())
+        self.assertEqual(Product.objects.get(slug='nb-1').price, Decimal('100.50'))
+        self.assertEqual(get_sidebar_categories()[0]['count'], 2)
+        self.assertEqual(search_products('light')[0][0].slug, 'nb-1')
+        self.assertEqual(Job.objects.filter(task='build_product_derivatives').count(), 3)
+
+        path = self.write_file('update.csv', (
+            'category_slug,category_name,slug,title,description,price,image\n'
+            'phones,Phones,nb-1,Notebook 1,Light,99,nb-1.jpg\n'
+            'notebooks,Notebooks,nb-2,Notebook 2,,200,nb-2.jpg\n'
+        ))
+        out = StringIO()
+        call_command('import_catalog', path, stdout=out)
+        self.assertIn('0 created, 1 updated', out.getvalue())
+        product = Product.objects.get(slug='nb-1')
+        self.assertEqual((product.category.slug, product.price), ('phones', Decimal('99.00')))
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_price_validation(self):
+        path = self.write_file('catalog.jsonl', (
+            '{"category_slug": "c", "slug": "free", "title": "Free", "price": 0}\n'
+            '{"category_slug": "c", "slug": "nan", "title": "NaN", "price": "NaN"}\n'
+            '{"category_slug": "c", "slug": "inf", "title": "Inf", "price": "Infinity"}\n'
+            '{"category_slug": "c", "slug": "negative", "title": "Negative", "price": "-1"}\n'
+            '{"category_slug": "c", "slug": "none", "title": "None", "price": null}\n'
+        ))
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', path, '--no-derivatives', stdout=out, stderr=err)
+        self.assertIn('1 created, 0 updated, 4 skipped', out.getvalue())
+        self.assertEqual(Product.objects.get().price, Decimal('0.00'))
+        for line, value in ((2, "'NaN'"), (3, "'Infinity'"), (4, "'-1'")):
+            self.assertIn(f'Row {line}: invalid price {value}', err.getvalue())
+        self.assertIn('Row 5: missing price', err.getvalue())
+
+    def test_image_paths_stay_in_images_dir(self):
+        images_dir = f'{self.tmp}/images'
+        os.mkdir(images_dir)
+        with open(f'{self.tmp}/secret.png', 'wb') as image_file:
+            image_file.write(make_image().read())
+        os.symlink(f'{self.tmp}/secret.png', f'{images_dir}/link.png')
+        path = self.write_file('catalog.csv', (
+            'category_slug,slug,title,price,image\n'
+            'notebooks,nb-1,Notebook 1,10,../secret.png\n'
+            'notebooks,nb-2,Notebook 2,10,link.png\n'
+        ))
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', path, '--images-dir', images_dir, stdout=out, stderr=err)
+        self.assertIn("Row 1: invalid image name '../secret.png'", err.getvalue())
+        self.assertIn('Image link.png: link.png is outside the images directory', err.getvalue())
+        self.assertIn('0 images', out.getvalue())
+
+    def test_batch_queries_do_not_grow_with_rows(self):
+        lines = ''.join(f'{{"category_slug": "c", "slug": "p-{i}", "title": "P {i}", "price": "1"}}\n' for i in range(200))
+        path = self.write_file('catalog.jsonl', lines)
+        with CaptureQueriesContext(connection) as queries:
+            call_command('import_catalog', path, '--batch-size', '200', '--no-derivatives', stdout=StringIO())
+        self.assertLess(len(queries), 20)
+        self.assertEqual(Product.objects.count(), 200)
+
+    def test_malformed_jsonl_lines_are_skipped(self):
+        path = self.write_file('catalog.jsonl', (
+            '{"category_slug": "c", "slug": "p-1", "title": "P 1", "price": "1"}\n'
+            '{"category_slug": "c", "slug": \n'
+            '\n'
+            '["c", "p-2"]\n'
+            '{"category_slug": "c", "slug": "p-3", "title": "P 3", "price": "3"}\n'
+        ))
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', path, '--no-derivatives', stdout=out, stderr=err)
+        self.assertIn('2 created, 0 updated, 2 skipped', out.getvalue())
+        self.assertIn('Row 2: invalid JSON on line 2', err.getvalue())
+        self.assertIn('Row 3: line 4 is not a JSON object', err.getvalue())
+
+    def test_export_import_round_trip(self):
+        category = Category.objects.create(name='Notebooks', slug='notebooks')
+        make_products(category, 5)
+        for fmt in ('csv', 'jsonl'):
+            path = f'{self.tmp}/export.{fmt}'
+            call_command('export_catalog', '--output', path, stdout=StringIO(), stderr=StringIO())
+            Product.objects.all().delete()
+            call_command('import_catalog', path, stdout=StringIO())
+            self.assertEqual(
+                list(Product.objects.order_by('slug').values_list('slug', 'title', 'price')),
+                [(f'notebooks-product-{i}', f'Product {i}', Decimal('10.00') + i) for i in range(5)]
+            )
+
+    def test_images_copied_from_directory(self):
+        with open(f'{self.tmp}/nb.png', 'wb') as image_file:
+            image_file.write(make_image().read())
+        with open(f'{self.tmp}/small.png', 'wb') as image_file:
+            image_file.write(make_image(size=(100, 100)).read())
+        path = self.write_file('catalog.csv', (
+            'category_slug,slug,title,price,image\n'
+            'notebooks,nb-1,Notebook 1,10,nb.png\n'
+            'notebooks,nb-2,Notebook 2,10,missing.png\n'
+            'notebooks,nb-3,Notebook 3,10,small.png\n'
+        ))
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', path, '--images-dir', self.tmp, stdout=out, stderr=err)
+        self.assertIn('1 images', out.getvalue())
+        self.assertIn('Image missing.png', err.getvalue())
+        self.assertIn('Image small.png: Image resolution 100x100 is lower than 400x400', err.getvalue())
+        storage = Product.objects.get(slug='nb-1').image.storage
+        self.assertTrue(storage.exists('nb.png'))
+        self.assertFalse(storage.exists('small.png'))
+
+
+class OrderExportTestCases(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='finance', password='password', is_staff=True)
+        self.customer = Customer.objects.create(user=self.user, phone='111')
+        category = Category.objects.create(name='Notebooks', slug='notebooks')
+        self.products = make_products(category, 2)
+
+    def make_orders(self, count):
+        for i in range(count):
+            cart = Cart.objects.create(owner=self.customer)
+            for product in self.products:
+                add_cart_product(cart, product)
+            place_order(cart, self.customer, Order(first_name='Ann', last_name=f'Order {i}', phone='111', address='Street'))
+
+    def test_rows_per_line_and_empty_orders(self):
+        self.make_orders(2)
+        Order.objects.create(customer=self.customer, first_name='Ann', last_name='Empty', phone='111')
+        rows = list(iter_order_rows(chunk_size=2))
+        self.assertEqual(len(rows), 5)
+        fields = dict(zip(ORDER_EXPORT_FIELDS, rows[0]))
+        self.assertEqual((fields['username'], fields['product_slug'], fields['qty']), ('finance', 'notebooks-product-0', 1))
+        self.assertEqual((fields['total'], fields['unit_price']), (Decimal('21.00'), Decimal('10.00')))
+        self.assertEqual(rows[-1][ORDER_EXPORT_FIELDS.index('product_slug')], '')
+
+    def test_queries_per_chunk_not_per_order(self):
+        self.make_orders(3)
+        with CaptureQueriesContext(connection) as small:
+            list(iter_order_rows(chunk_size=4))
+        self.make_orders(3)
+        with CaptureQueriesContext(connection) as large:
+            list(iter_order_rows(chunk_size=8))
+        self.assertEqual(len(small), 2)
+        self.assertEqual(len(large), 2)
+
+    def test_streaming_view_is_staff_only(self):
+        self.make_orders(1)
+        client = Client()
+        self.assertEqual(client.get(reverse('order_export')).status_code, 302)
+        client.login(username='finance', password='password')
+        response = client.get(reverse('order_export'))
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ','.join(ORDER_EXPORT_FIELDS))
+        self.assertEqual(len(lines), 3)
+
+    def test_command_writes_csv(self):
+        self.make_orders(2)
+        out = StringIO()
+        call_command('export_orders', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 5)
+
+
+class CheckoutTestCases(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.customer = Customer.objects.create(user=self.user)
+        category = Category.objects.create(name='Notebooks', slug='notebooks')
+        self.cart = Cart.objects.create(owner=self.customer)
+        for product in make_products(category, 2):
+            add_cart_product(self.cart, product)
+        self.client.login(username='buyer', password='password')
+        session = self.client.session
+        session[CART_SESSION_KEY] = self.cart.pk
+        session.save()
+
+    def order_data(self, key):
+        return {
+            'first_name': 'Ann', 'last_name': 'Buyer', 'phone': '111', 'buying_type': 'self',
+            'order_date_year': '2020', 'order_date_month': '1', 'order_date_day': '1', 'idempotency_key': key
+        }
+
+    def test_double_submit_creates_one_order(self):
+        key = self.client.get(reverse('checkout')).context['form'].initial['idempotency_key']
+        for _ in range(2):
+            response = self.client.post(reverse('make_order'), self.order_data(key))
+            self.assertEqual(response.url, '/')
+        order = Order.objects.get()
+        self.assertEqual((order.cart_id, order.idempotency_key), (self.cart.pk, key))
+        self.assertTrue(Cart.objects.get(pk=self.cart.pk).in_order)
+
+    def test_new_user_checks_out_anonymous_cart(self):
+        client = Client()
+        client.get(reverse('add_to_cart', kwargs={'slug': 'notebooks-product-0'}))
+        client.force_login(User.objects.create_user(username='newcomer'))
+        response = client.post(reverse('make_order'), self.order_data('new-user'))
+        self.assertEqual(response.url, '/')
+        self.assertEqual(Order.objects.get().customer.user.username, 'newcomer')
+
+    def test_anonymous_order_redirects_to_login(self):
+        response = Client().post(reverse('make_order'), self.order_data('anonymous'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('next=/checkout/', response.url)
+        self.assertFalse(Order.objects.exists())
+
+    def test_ordered_cart_is_rejected_without_key(self):
+        place_order(self.cart, self.customer, Order(first_name='Ann', last_name='Buyer', phone='111'))
+        with self.assertRaises(CheckoutError):
+            place_order(self.cart, self.customer, Order(first_name='Ann', last_name='Buyer', phone='111'))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_order_keeps_price_snapshot(self):
+        with CaptureQueriesContext(connection) as queries:
+            order, created = place_order(self.cart, self.customer, Order(first_name='Ann', last_name='Buyer', phone='111'))
+        self.assertLessEqual(len(queries), 8)
+        Product.objects.update(price=Decimal('99.00'))
+        CartProduct.objects.all().delete()
+        order = Order.objects.get(pk=order.pk)
+        self.assertEqual((order.total_products, order.total), (2, Decimal('21.00')))
+        self.assertEqual(
+            list(order.items.values_list('title', 'unit_price', 'qty', 'line_total')),
+            [('Product 0', Decimal('10.00'), 1, Decimal('10.00')), ('Product 1', Decimal('11.00'), 1, Decimal('11.00'))]
+        )
+
+    def test_empty_cart_is_rejected(self):
+        cart = Cart.objects.create(owner=self.customer)
+        with self.assertRaises(CheckoutError):
+            place_order(cart, self.customer, Order(first_name='Ann', last_name='Buyer', phone='111'))
+        self.assertFalse(Cart.objects.get(pk=cart.pk).in_order)
+
+
+class ConcurrentCheckoutTestCases(TransactionTestCase):
+
+    workers = 8
+
+    def test_concurrent_checkouts_create_one_order(self):
+        user = User.objects.create_user(username='buyer', password='password')
+        customer = Customer.objects.create(user=user)
+        cart = Cart.objects.create(owner=customer)
+        add_cart_product(cart, make_products(Category.objects.create(name='C', slug='c'), 1)[0])
+        barrier = threading.Barrier(self.workers)
+        results = []
+
+        def checkout(worker):
+            barrier.wait()
+            try:
+                for _ in range(50):
+                    try:
+                        order = Order(first_name='Ann', last_name=f'Tab {worker}', phone='111')
+                        results.append(place_order(Cart.objects.get(pk=cart.pk), customer, order, f'key-{worker}')[1])
+                        return
+                    except CheckoutError:
+                        results.append(False)
+                        return
+                    except OperationalError:
+                        # sqlite reports lock contention instead of blocking; retry like a client would
+                        time.sleep(0.01)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=checkout, args=(worker,)) for worker in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), self.workers)
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(Order.objects.filter(cart=cart).count(), 1)
+
+
+class OrderHistoryTestCases(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.customer = Customer.objects.create(user=self.user)
+        self.products = make_products(Category.objects.create(name='Notebooks', slug='notebooks'), 2)
+        other = Customer.objects.create(user=User.objects.create_user(username='other', password='password'))
+        self.place(other, 'Other')
+        self.client.login(username='buyer', password='password')
+
+    def place(self, customer, name):
+        cart = Cart.objects.create(owner=customer)
+        for product in self.products:
+            add_cart_product(cart, product)
+        return place_order(cart, customer, Order(first_name=name, last_name='Buyer', phone='111'))[0]
+
+    def test_keyset_pages_newest_first(self):
+        orders = [self.place(self.customer, f'Order {i}') for i in range(12)]
+        response = self.client.get(reverse('order_history'))
+        self.assertEqual([order.pk for order in response.context['orders']], [order.pk for order in orders[:1:-1]])
+        self.assertContains(response, 'Product 1', count=10)
+        page = response.context['page']
+        response = self.client.get(reverse('order_history'), {'after': page.next_cursor})
+        self.assertEqual([order.pk for order in response.context['orders']], [orders[1].pk, orders[0].pk])
+        self.assertFalse(response.context['page'].has_next)
+
+    def test_queries_do_not_grow_with_orders(self):
+        self.place(self.customer, 'First')
+        self.client.get(reverse('order_history'))
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('order_history'))
+        for i in range(5):
+            self.place(self.customer, f'Order {i}')
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(reverse('order_history'))
+        self.assertEqual(len(few), len(many))
+
+    def test_anonymous_is_redirected(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('order_history')).status_code, 302)
+
+    def test_history_uses_customer_created_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'EXPLAIN QUERY PLAN SELECT id FROM main_order WHERE customer_id = %s ORDER BY created_at DESC, id DESC LIMIT 11',
+                [self.customer.pk]
+            )
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('order_customer_created_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class PruneCartsTestCases(TestCase):
+
+    def setUp(self) -> None:
+        self.customer = Customer.objects.create(user=User.objects.create_user(username='buyer', password='password'))
+        self.product = make_products(Category.objects.create(name='Notebooks', slug='notebooks'), 1)[0]
+
+    def make_cart(self, days_idle, owner=None):
+        cart = Cart.objects.create(owner=owner)
+        add_cart_product(cart, self.product)
+        Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now() - timedelta(days=days_idle))
+        return cart
+
+    def test_prunes_idle_carts_in_batches(self):
+        stale = [self.make_cart(40) for _ in range(5)]
+        fresh = self.make_cart(1)
+        ordered = self.make_cart(40, owner=self.customer)
+        place_order(ordered, self.customer, Order(first_name='Ann', last_name='Buyer', phone='111'))
+        Cart.objects.filter(pk=ordered.pk).update(updated_at=timezone.now() - timedelta(days=40))
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = prune_carts(timedelta(days=30), batch_size=2)
+        self.assertEqual((stats['carts'], stats['lines']), (5, 5))
+        self.assertLess(len(queries), 30)
+        self.assertFalse(Cart.objects.filter(pk__in=[cart.pk for cart in stale]).exists())
+        self.assertEqual(set(Cart.objects.values_list('pk', flat=True)), {fresh.pk, ordered.pk})
+        self.assertEqual(Order.objects.get().cart_id, ordered.pk)
+
+    def test_cart_changes_refresh_updated_at(self):
+        cart = self.make_cart(40)
+        change_cart_product_qty(cart, self.product, 2)
+        self.assertEqual(prune_carts(timedelta(days=30))['carts'], 0)
+
+    def test_command_archives_and_reports_rate(self):
+        cart = self.make_cart(40)
+        path = f'{tempfile.mkdtemp()}/carts.jsonl'
+        out = StringIO()
+        call_command('prune_carts', '--days', '30', '--archive', path, stdout=out)
+        self.assertIn('1 carts and 1 lines removed', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+        with open(path) as archive:
+            archived = json.loads(archive.readline())
+        self.assertEqual((archived['id'], archived['lines'][0]['product_id']), (cart.pk, self.product.pk))
+
+    def test_archived_carts_are_the_deleted_carts(self):
+        carts = [self.make_cart(40) for _ in range(3)]
+
+        def archive_then_touch(cart_ids, stream):
+            archive_carts(cart_ids, stream)
+            Cart.objects.filter(pk=carts[0].pk).update(updated_at=timezone.now())
+
+        archive = StringIO()
+        with mock.patch('main.cart_cleanup.archive_carts', side_effect=archive_then_touch):
+            stats = prune_carts(timedelta(days=30), archive=archive)
+        archived = [json.loads(line)['id'] for line in archive.getvalue().splitlines()]
+        self.assertEqual((stats['carts'], sorted(archived)), (3, [cart.pk for cart in carts]))
+        self.assertFalse(Cart.objects.exists())
+
+    @override_settings(JOBS_EXECUTOR=None)
+    def test_scheduled_prune_reschedules_itself(self):
+        self.make_cart(40)
+        job = schedule_prune_carts(60)
+        self.assertEqual(jobs.drain(), 0)
+        with mock.patch('django.utils.timezone.now', return_value=job.run_after + timedelta(seconds=1)):
+            self.assertEqual(jobs.drain(), 1)
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(Job.objects.filter(task='prune_carts', status=Job.STATUS_PENDING).count(), 1)
+
+    @override_settings(JOBS_EXECUTOR=None)
+    def test_failed_prune_still_reschedules(self):
+        job = schedule_prune_carts(60)
+        with mock.patch('main.cart_cleanup.prune_carts', side_effect=OperationalError('database is locked')):
+            for _ in range(2):
+                with self.assertRaises(OperationalError):
+                    prune_carts_task(**job.payload)
+        self.assertEqual(
+            list(Job.objects.filter(task='prune_carts').order_by('id').values_list('key', flat=True)),
+            [job.key, f'prune_carts:{job.payload["slot"] + 1}']
+        )
+
+
+@override_settings(PERF_SAMPLE_RATE=1.0, PERF_SERVER_TIMING=True)
+class InstrumentationTestCases(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        reset_stats()
+        make_products(Category.objects.create(name='Notebooks', slug='notebooks'), 3)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('base'))
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'total;dur=[\d.]+')
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertRegex(timing, r'tpl;dur=[\d.]+')
+        self.assertIn('misses', timing)
+
+    def test_aggregates_per_url_name(self):
+        self.client.get(reverse('base'))
+        self.client.get(reverse('base'))
+        stats = get_stats()['base']
+        self.assertEqual(stats['requests'], 2)
+        self.assertGreater(stats['queries'], 0)
+        self.assertGreater(stats['cache_hits'], 0)
+
+    def test_asgi_requests_are_recorded(self):
+        response = async_to_sync(AsyncClient().get)(reverse('base'))
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertEqual(get_stats()['base']['requests'], 1)
+
+    @override_settings(QUERY_BUDGETS={'base': 0})
+    def test_over_budget_requests_are_counted(self):
+        with self.assertLogs('main.instrumentation', 'WARNING'):
+            self.client.get(reverse('base'))
+        self.assertEqual(get_stats()['base']['over_budget'], 1)
+
+    @override_settings(PERF_SERVER_TIMING=False)
+    def test_server_timing_header_is_opt_in(self):
+        response = self.client.get(reverse('base'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(get_stats()['base']['requests'], 1)
+
+    @override_settings(PERF_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_recorded(self):
+        response = self.client.get(reverse('base'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(get_stats(), {})
+
+    def test_stats_endpoint_is_staff_only(self):
+        self.client.get(reverse('base'))
+        self.assertEqual(self.client.get(reverse('perf_stats')).status_code, 302)
+        User.objects.create_user(username='admin', password='password', is_staff=True)
+        self.client.login(username='admin', password='password')
+        self.assertEqual(self.client.get(reverse('perf_stats')).json()['views']['base']['requests'], 1)
+
+
+
+class QueryBudgetTestCases(TestCase):
+    """Every storefront URL on a catalog, cart and order history of realistic size, with cold caches."""
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = [Category.objects.create(name=f'Category {i}', slug=f'category-{i}') for i in range(3)]
+        cls.products = [product for category in categories for product in make_products(category, 30)]
+        cls.user = User.objects.create_user(username='buyer', password='password')
+        cls.staff = User.objects.create_user(username='admin', password='password', is_staff=True)
+        cls.customer = Customer.objects.create(user=cls.user)
+        for i in range(15):
+            cart = Cart.objects.create(owner=cls.customer)
+            for product in cls.products[i:i + 3]:
+                add_cart_product(cart, product)
+            place_order(cart, cls.customer, Order(first_name='Ann', last_name=f'Order {i}', phone='111'))
+
+    def setUp(self) -> None:
+        self.cart = Cart.objects.create(owner=self.customer)
+        for product in self.products[:10]:
+            add_cart_product(self.cart, product)
+        self.client.login(username='buyer', password='password')
+        session = self.client.session
+        session[CART_SESSION_KEY] = self.cart.pk
+        session.save()
+
+    def request(self, url_name, method='get', data=None, **kwargs):
+        cache.clear()
+        product_cache.clear()
+        invalidate_sidebar_categories()
+        with query_budget(url_name):
+            response = getattr(self.client, method)(reverse(url_name, kwargs=kwargs), data)
+        self.assertIn(response.status_code, (200, 302))
+        return response
+
+    def test_first_visits(self):
+        # A new session per request: nothing is cached for the visitor, and the user has no Customer yet.
+        pages = [
+            ('base', {}), ('product_detail', {'slug': self.products[0].slug}), ('category_detail', {'slug': 'category-0'}),
+            ('cart', {}), ('cart_badge', {}), ('checkout', {}), ('order_history', {}), ('api_cart', {}),
+            ('add_to_cart', {'slug': self.products[0].slug}),
+        ]
+        for i, (url_name, kwargs) in enumerate(pages):
+            for logged_in in (True, False):
+                self.client = Client()
+                if logged_in:
+                    self.client.force_login(User.objects.create_user(username=f'visitor-{i}'))
+                self.request(url_name, **kwargs)
+
+    def test_catalog_pages(self):
+        for logged_in in (True, False):
+            if not logged_in:
+                self.client.logout()
+            self.request('base')
+            self.request('product_detail', slug=self.products[0].slug)
+            self.request('category_detail', slug='category-0')
+            self.request('category_detail', data={'sort': 'price', 'min_price': '5'}, slug='category-1')
+            self.request('search', data={'q': 'product'})
+
+    def test_cart_pages(self):
+        self.request('cart')
+        self.request('cart_badge')
+        self.request('checkout')
+        self.request('order_history')
+
+    def test_cart_mutations(self):
+        self.request('add_to_cart', slug=self.products[20].slug)
+        self.request('change_qty', method='post', data={'qty': 3}, slug=self.products[0].slug)
+        self.request('delete_from_cart', slug=self.products[1].slug)
+        self.request('make_order', method='post', data={
+            'first_name': 'Ann', 'last_name': 'Buyer', 'phone': '111', 'buying_type': 'self',
+            'order_date_year': '2020', 'order_date_month': '1', 'order_date_day': '1', 'idempotency_key': 'budget'
+        })
+        self.assertTrue(Order.objects.filter(idempotency_key='budget').exists())
+
+    def test_staff_reports(self):
+        self.client.login(username='admin', password='password')
+        response = self.request('order_export')
+        with query_budget('order_export'):
+            b''.join(response.streaming_content)
+        self.request('perf_stats')
+
+    def test_api(self):
+        response = self.request('api_products', data={'category': 'category-1', 'sort': 'price'})
+        with query_budget('api_products'):
+            b''.join(response.streaming_content)
+        self.request('api_categories')
+        self.request('api_product_detail', slug=self.products[0].slug)
+        self.request('api_cart')
+        self.request('api_cart_action', method='post', action='add', slug=self.products[20].slug)
+        self.request('api_cart_action', method='post', data={'qty': 2}, action='qty', slug=self.products[0].slug)
+        self.request('api_cart_action', method='post', action='remove', slug=self.products[1].slug)
+
+    def test_cart_batches(self):
+        data = {f'qty-{product.slug}': 2 for product in self.products[:10]}
+        data.update({'remove': [self.products[1].slug, self.products[2].slug], 'add': self.products[40].slug})
+        self.request('update_cart', method='post', data=data)
+        operations = [{'op': 'add', 'slug': product.slug} for product in self.products[50:70]]
+        operations += [{'op': 'qty', 'slug': product.slug, 'qty': 5} for product in self.products[3:10]]
+        cache.clear()
+        with query_budget('api_cart_batch'):
+            response = self.client.post(
+                reverse('api_cart_batch'), json.dumps({'operations': operations}), content_type='application/json'
+            )
+        self.assertEqual(json.loads(response.content)['total_products'], 29)
+
+    def test_budget_failure_lists_queries(self):
+        with self.assertRaisesRegex(QueryBudgetExceeded, r'ran 2 queries, budget is 1:\n1\. SELECT'):
+            with query_budget(max_queries=1):
+                list(Product.objects.all())
+                list(Category.objects.all())
+
+    def test_savepoints_are_not_counted(self):
+        with query_budget(max_queries=1) as queries:
+            with transaction.atomic():
+                list(Product.objects.all())
+        self.assertEqual(len(queries), 1)
+
+
+class AsyncViewTestCases(TransactionTestCase):
+    """The async views run their lookups on worker threads, so the data has to be committed."""
+
+    def setUp(self) -> None:
+        cache.clear()
+        invalidate_sidebar_categories()
+        self.category = Category.objects.create(name='Notebooks', slug='notebooks')
+        self.products = make_products(self.category, 30)
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.cart = Cart.objects.create(owner=Customer.objects.create(user=self.user))
+        for product in self.products[:3]:
+            add_cart_product(self.cart, product)
+
+    def request(self, path='/', user=None, data=None):
+        request = RequestFactory().get(path, data)
+        request.user = user or AnonymousUser()
+        request.session = SessionStore()
+        return request
+
+    def assertSameResponse(self, sync_view, async_view, user=None, data=None, **kwargs):
+        cache.clear()
+        expected = sync_view.as_view()(self.request(user=user, data=data), **kwargs)
+        if hasattr(expected, 'render'):
+            expected.render()
+        cache.clear()
+        response = async_to_sync(async_view.as_view())(self.request(user=user, data=data), **kwargs)
+        self.assertEqual(response.status_code, 200)
+        csrf_token = re.compile(r'name="csrfmiddlewaretoken" value="[^"]+"')
+        self.assertEqual(csrf_token.sub('', response.content.decode()), csrf_token.sub('', expected.content.decode()))
+        return response
+
+    def test_pages_match_sync_views(self):
+        for user in (None, self.user):
+            self.assertSameResponse(BaseView, AsyncBaseView, user)
+            self.assertSameResponse(ProductDetailView, AsyncProductDetailView, user, slug=self.products[0].slug)
+            self.assertSameResponse(CategoryDetailView, AsyncCategoryDetailView, user, slug='notebooks')
+            self.assertSameResponse(
+                CategoryDetailView, AsyncCategoryDetailView, user, data={'sort': '-price', 'min_price': '15'}, slug='notebooks'
+            )
+        response = self.assertSameResponse(CartView, AsyncCartView, self.user)
+        self.assertContains(response, 'Product 2')
+
+    def test_anonymous_pages_are_cached_and_conditional(self):
+        view = async_to_sync(AsyncProductDetailView.as_view())
+        response = view(self.request(), slug=self.products[0].slug)
+        request = self.request()
+        request.META['HTTP_IF_NONE_MATCH'] = response['ETag']
+        self.assertEqual(view(request, slug=self.products[0].slug).status_code, 304)
+
+    def test_missing_objects_raise_404(self):
+        with self.assertRaises(Http404):
+            async_to_sync(AsyncCategoryDetailView.as_view())(self.request(), slug='missing')
+        with self.assertRaises(Http404):
+            async_to_sync(AsyncProductDetailView.as_view())(self.request(), slug='missing')
+
+    def test_disallowed_method(self):
+        request = RequestFactory().post('/')
+        request.user, request.session = AnonymousUser(), SessionStore()
+        self.assertEqual(async_to_sync(AsyncCartView.as_view())(request).status_code, 405)
+
+
+class CatalogAPITestCases(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        product_cache.clear()
+        invalidate_sidebar_categories()
+        self.category = Category.objects.create(name='Notebooks', slug='notebooks')
+        self.products = make_products(self.category, 30)
+        make_products(Category.objects.create(name='Phones', slug='phones'), 2)
+
+    def get_json(self, url, data=None, **extra):
+        response = self.client.get(url, data, **extra)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, json.loads(content)
+
+    def test_categories(self):
+        response, data = self.get_json(reverse('api_categories'))
+        self.assertEqual(data['results'][0], {'name': 'Notebooks', 'slug': 'notebooks', 'count': 30})
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_products_stream_keyset_pages(self):
+        url = reverse('api_products')
+        response, data = self.get_json(url, {'category': 'notebooks', 'sort': '-price', 'limit': 20})
+        self.assertTrue(response.streaming)
+        self.assertEqual(len(data['results']), 20)
+        self.assertEqual(data['results'][0]['slug'], 'notebooks-product-29')
+        self.assertEqual(data['results'][0]['price'], '39.00')
+        self.assertIsNone(data['previous'])
+        response, data = self.get_json(url, {'category': 'notebooks', 'sort': '-price', 'limit': 20, 'after': data['next']})
+        self.assertEqual([row['slug'] for row in data['results']][-1], 'notebooks-product-0')
+        self.assertIsNone(data['next'])
+
+    def test_product_detail_and_404(self):
+        response, data = self.get_json(reverse('api_product_detail', kwargs={'slug': 'notebooks-product-3'}))
+        self.assertEqual((data['title'], data['category_name'], data['price']), ('Product 3', 'Notebooks', '13.00'))
+        response, data = self.get_json(reverse('api_product_detail', kwargs={'slug': 'missing'}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_conditional_get_without_queries(self):
+        url = reverse('api_products')
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.products[0].save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_cart_operations(self):
+        client = Client(enforce_csrf_checks=True)
+        response = client.get(reverse('api_cart'))
+        self.assertEqual(json.loads(response.content)['items'], [])
+        csrf = {'HTTP_X_CSRFTOKEN': response.cookies['csrftoken'].value}
+        action = lambda name, slug: reverse('api_cart_action', kwargs={'action': name, 'slug': slug})
+
+        self.assertEqual(client.post(action('add', 'notebooks-product-1')).status_code, 403)
+        client.post(action('add', 'notebooks-product-1'), **csrf)
+        response = client.post(action('add', 'notebooks-product-2'), **csrf)
+        self.assertEqual(json.loads(response.content)['total_products'], 2)
+        response = client.post(
+            action('qty', 'notebooks-product-1'), json.dumps({'qty': 3}), content_type='application/json', **csrf
+        )
+        data = json.loads(response.content)
+        self.assertEqual((data['items'][0]['qty'], data['final_price']), (3, '45.00'))
+        data = json.loads(client.post(action('remove', 'notebooks-product-2'), **csrf).content)
+        self.assertEqual([item['slug'] for item in data['items']], ['notebooks-product-1'])
+
+        self.assertEqual(client.post(action('qty', 'notebooks-product-1'), {'qty': 0}, **csrf).status_code, 400)
+        for qty in (None, [2], '2.5x', {}):
+            response = client.post(
+                action('qty', 'notebooks-product-1'), json.dumps({'qty': qty}), content_type='application/json', **csrf
+            )
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(client.post(action('remove', 'notebooks-product-5'), **csrf).status_code, 404)
+        self.assertEqual(client.post(action('add', 'missing'), **csrf).status_code, 404)
+        self.assertEqual(client.post(action('buy', 'notebooks-product-1'), **csrf).status_code, 404)
+
+
+class CartBatchTestCases(TestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(username='testuser', password='password')
+        self.customer = Customer.objects.create(user=self.user)
+        self.products = make_products(Category.objects.create(name='Notebooks', slug='notebooks'), 10)
+        self.cart = Cart.objects.create(owner=self.customer)
+        for product in self.products[:3]:
+            add_cart_product(self.cart, product)
+
+    def lines(self):
+        return dict(self.cart.related_products.values_list('product__slug', 'qty'))
+
+    def test_operations_apply_in_order_with_bounded_queries(self):
+        slug = lambda i: self.products[i].slug
+        operations = [
+            ('qty', slug(0), 4), ('remove', slug(1)), ('add', slug(5)), ('qty', slug(5), 3), ('add', slug(6), '2'),
+            ('add', slug(2)), ('remove', slug(6)), ('add', slug(1)),
+        ]
+        with self.assertNumQueries(7):
+            written = apply_cart_operations(self.cart, operations)
+        self.assertEqual(written, 2)
+        self.assertEqual(self.lines(), {slug(0): 4, slug(1): 1, slug(2): 1, slug(5): 3})
+        self.assertEqual((self.cart.total_products, self.cart.final_price), (4, Decimal('108.00')))
+        self.assertTrue(verify_cart_totals(Cart.objects.get(pk=self.cart.pk)))
+        self.assertEqual(CartProduct.objects.get(cart=self.cart, product=self.products[5]).user, self.customer)
+
+    def test_invalid_batch_writes_nothing(self):
+        before = self.lines()
+        invalid = [
+            [('add', self.products[5].slug), ('add', 'missing')],
+            [('qty', self.products[0].slug, 0)],
+            [('qty', self.products[0].slug, 'many')],
+            [('remove', self.products[8].slug)],
+            [('remove', self.products[0].slug), ('qty', self.products[0].slug, 2)],
+            [('buy', self.products[0].slug)],
+        ]
+        for operations in invalid:
+            with self.assertRaises(CartOperationError):
+                apply_cart_operations(self.cart, operations)
+        self.assertEqual(self.lines(), before)
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).total_products, 3)
+
+    def test_update_cart_form(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('cart'))
+        response = self.client.post(reverse('update_cart'), {
+            f'qty-{self.products[0].slug}': '2', f'qty-{self.products[1].slug}': '1', f'qty-{self.products[2].slug}': '5',
+            'remove': [self.products[2].slug], 'add': [self.products[7].slug],
+        })
+        self.assertRedirects(response, '/cart/', fetch_redirect_response=False)
+        self.assertEqual(self.lines(), {self.products[0].slug: 2, self.products[1].slug: 1, self.products[7].slug: 1})
+        response = self.client.post(reverse('update_cart'), {f'qty-{self.products[0].slug}': '-1'})
+        self.assertEqual(self.lines()[self.products[0].slug], 2)
+        self.assertContains(self.client.get(reverse('cart')), 'must be a positive integer')
+
+    def test_api_batch_for_new_visitor(self):
+        client = Client(enforce_csrf_checks=True)
+        csrf = {'HTTP_X_CSRFTOKEN': client.get(reverse('api_cart')).cookies['csrftoken'].value}
+        post = lambda payload: client.post(
+            reverse('api_cart_batch'), json.dumps(payload), content_type='application/json', **csrf
+        )
+        response = post({'operations': [{'op': 'add', 'slug': self.products[4].slug, 'qty': 2}, {'op': 'add', 'slug': self.products[9].slug}]})
+        data = json.loads(response.content)
+        self.assertEqual(data['final_price'], '47.00')
+        self.assertEqual([(item['slug'], item['qty']) for item in data['items']], [(self.products[4].slug, 2), (self.products[9].slug, 1)])
+        self.assertEqual(post({'operations': 'add'}).status_code, 400)
+        response = post({'operations': [{'op': 'qty', 'slug': self.products[0].slug, 'qty': 2}]})
+        self.assertEqual((response.status_code, json.loads(response.content)['error']), (400, f'{self.products[0].slug} is not in the cart'))
+
+
+class ProductLookupCacheTestCases(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        product_cache.clear()
+        product_cache.reset_stats()
+        self.category = Category.objects.create(name='Notebooks', slug='notebooks')
+        self.product = make_products(self.category, 1)[0]
+
+    def test_tiers_and_stats(self):
+        with self.assertNumQueries(1):
+            product = product_cache.get(self.product.slug)
+        self.assertEqual((product.pk, product.title, product.price, product.image.name, product.category_id),
+                         (self.product.pk, 'Product 0', Decimal('10.00'), 'product-0.jpg', self.category.pk))
+        self.assertEqual(product.get_deferred_fields(), {'description', 'has_derivatives', 'image_width', 'created_at', 'updated_at'})
+        with self.assertNumQueries(0):
+            product_cache.get(self.product.slug)
+            product_cache.clear()
+            product_cache.get(self.product.slug)
+        self.assertIsNone(product_cache.get('missing'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(product_cache.get('missing'))
+        self.assertEqual(product_cache.stats(), {
+            'size': 2, 'max_size': product_cache.size, 'local_hits': 2, 'shared_hits': 1, 'misses': 2,
+            'hit_rate': 0.6, 'local_hit_rate': 0.4,
+        })
+
+    def test_size_is_bounded(self):
+        products = make_products(self.category, 5, start=1)
+        with mock.patch.object(product_cache, 'size', 3):
+            for product in products:
+                product_cache.get(product.slug)
+            product_cache.get(products[3].slug)
+            product_cache.get(products[0].slug)
+        self.assertEqual(list(product_cache.entries), [products[4].slug, products[3].slug, products[0].slug])
+
+    def test_invalidated_on_save_and_delete(self):
+        product_cache.get(self.product.slug)
+        self.product.price = Decimal('99.00')
+        self.product.save()
+        self.assertEqual(product_cache.get(self.product.slug).price, Decimal('99.00'))
+
+        self.product.slug = 'renamed'
+        self.product.save()
+        self.assertIsNone(product_cache.get('notebooks-product-0'))
+        self.assertEqual(product_cache.get('renamed').pk, self.product.pk)
+
+        self.product.delete()
+        self.assertIsNone(product_cache.get('renamed'))
+
+    def test_invalidated_again_at_commit(self):
+        stale = product_cache.get(self.product.slug)
+        with mock.patch('main.product_cache.transaction.on_commit') as on_commit:
+            self.product.price = Decimal('99.00')
+            self.product.save()
+        # A concurrent lookup refills the caches from the row as it was before the commit.
+        cache.set(product_cache.key(self.product.slug), tuple(getattr(stale, f) for f in PRODUCT_CACHE_FIELDS))
+        self.assertEqual(product_cache.get(self.product.slug).price, Decimal('10.00'))
+        for callback, in (call.args for call in on_commit.call_args_list):
+            callback()
+        self.assertEqual(product_cache.get(self.product.slug).price, Decimal('99.00'))
+
+    def test_cart_lines_priced_from_database(self):
+        product = product_cache.get(self.product.slug)
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('12.00'))
+        cart = Cart.objects.create()
+        add_cart_product(cart, product_cache.get(self.product.slug))
+        self.assertEqual(CartProduct.objects.get(cart=cart).total_price, Decimal('12.00'))
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('15.00'))
+        change_cart_product_qty(cart, product, 2)
+        self.assertEqual(CartProduct.objects.get(cart=cart).total_price, Decimal('30.00'))
+        cart.refresh_from_db()
+        self.assertEqual(cart.final_price, Decimal('30.00'))
+
+    def test_cart_views_and_perf_stats(self):
+        User.objects.create_user(username='admin', password='password', is_staff=True)
+        self.client.login(username='admin', password='password')
+        self.client.get(reverse('add_to_cart', kwargs={'slug': self.product.slug}))
+        self.client.post(reverse('change_qty', kwargs={'slug': self.product.slug}), {'qty': 2})
+        self.assertEqual(CartProduct.objects.get(product=self.product).total_price, Decimal('20.00'))
+        self.assertEqual(self.client.get(reverse('add_to_cart', kwargs={'slug': 'missing'})).status_code, 404)
+        stats = json.loads(self.client.get(reverse('perf_stats')).content)['product_cache']
+        self.assertEqual((stats['misses'], stats['local_hits']), (2, 1))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], DATABASE_REPLICA_LAG=0)
+class ReplicaRoutingTestCases(TestCase):
+    """The replica test database is a separate sqlite database that only gets what ``replicate`` copies."""
+
+    databases = {'default', 'replica'}
+
+    def setUp(self) -> None:
+        cache.clear()
+        product_cache.clear()
+        invalidate_sidebar_categories()
+        self.category = Category.objects.create(name='Notebooks', slug='notebooks')
+        self.product = make_products(self.category, 1)[0]
+        Category.objects.using('replica').bulk_create([self.category])
+        Product.objects.using('replica').bulk_create([self.product])
+        Product.objects.filter(pk=self.product.pk).update(title='Primary title')
+
+    def tearDown(self) -> None:
+        invalidate_sidebar_categories()
+
+    def read_title(self, method='get', write=False):
+        def view(request):
+            if write:
+                Cart.objects.create()
+            return HttpResponse(Product.objects.get(pk=self.product.pk).title)
+        return ReplicaRoutingMiddleware(view)(getattr(RequestFactory(), method)('/')).content.decode()
+
+    def test_catalog_reads_in_safe_requests_use_replica(self):
+        self.assertEqual(self.read_title(), 'Product 0')
+        self.assertEqual(Product.objects.get(pk=self.product.pk).title, 'Primary title')
+        self.assertEqual(Category.objects.using('replica').count(), 1)
+
+    def test_writes_pin_the_request_to_primary(self):
+        self.assertEqual(self.read_title(write=True), 'Primary title')
+        self.assertEqual(self.read_title(method='post'), 'Primary title')
+        self.assertEqual(self.read_title(), 'Product 0')
+
+    @override_settings(DATABASE_REPLICA_LAG=5)
+    def test_catalog_write_falls_back_to_primary_for_lag(self):
+        self.product.title = 'Saved title'
+        self.product.save()
+        self.assertEqual(self.read_title(), 'Saved title')
+        cache.clear()
+        self.assertEqual(self.read_title(), 'Product 0')
+
+    def test_storefront_pages(self):
+        user = User.objects.create_user(username='buyer', password='password')
+        self.client.login(username='buyer', password='password')
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = self.client.get(reverse('product_detail', kwargs={'slug': self.product.slug}))
+        self.assertContains(response, 'Product 0')
+        self.assertEqual(len(replica_queries), 3)
+        self.assertTrue(all('main_product' in query['sql'] or 'main_category' in query['sql'] for query in replica_queries))
+
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            self.client.get(reverse('add_to_cart', kwargs={'slug': self.product.slug}))
+            self.client.post(reverse('change_qty', kwargs={'slug': self.product.slug}), {'qty': 2})
+        self.assertEqual(len(replica_queries), 0)
+        self.assertEqual(CartProduct.objects.get(user__user=user).qty, 2)
+        self.assertFalse(CartProduct.objects.using('replica').exists())
+
+    def test_product_cache_fills_from_primary(self):
+        view = ReplicaRoutingMiddleware(lambda request: HttpResponse(product_cache.get(self.product.slug).title))
+        self.assertEqual(view(RequestFactory().get('/')).content.decode(), 'Primary title')
+
+    def test_query_budget_counts_replica_queries(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(max_queries=1):
+                Product.objects.using('replica').count()
+                Product.objects.count()
+        with query_budget(max_queries=1, using='default'):
+            Product.objects.using('replica').count()
+            Product.objects.count()
+
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}, DATABASE_REPLICA_LAG=5
+    )
+    def test_warns_without_shared_cache(self):
+        self.assertEqual([error.id for error in check_shared_cache(None)], ['main.W001'])
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_reports_read_replica(self):
+        customer = Customer.objects.create(user=User.objects.create(username='buyer'))
+        cart = Cart.objects.create(owner=customer)
+        add_cart_product(cart, self.product)
+        place_order(cart, customer, Order(first_name='Ann', last_name='Buyer', phone='111'))
+        self.assertEqual(list(iter_order_rows()), [])
+        self.assertEqual(len(list(iter_order_rows(using='default'))), 1)
@@ -1,15 +1,35 @@
+from django.conf import settings
 from django.urls import path
 
+from .api import CartAPIView, CategoryListAPIView, ProductDetailAPIView, ProductListAPIView
 from .views import *
 
+if settings.ASYNC_STOREFRONT:
+    from .async_views import (
+        AsyncBaseView as BaseView, AsyncCartView as CartView, AsyncCategoryDetailView as CategoryDetailView,
+        AsyncProductDetailView as ProductDetailView
+    )
+
 urlpatterns = [
     path('', BaseView.as_view(), name='base'),
     path('products/<str:slug>/', ProductDetailView.as_view(), name='product_detail'),
     path('category/<str:slug>', CategoryDetailView.as_view(), name='category_detail'),
+    path('search/', SearchView.as_view(), name='search'),
     path('cart/', CartView.as_view(), name='cart'),
+    path('cart/badge/', CartBadgeView.as_view(), name='cart_badge'),
     path('add-to-cart/<str:slug>/', AddToCartView.as_view(), name='add_to_cart'),
     path('remove-from-cart/<str:slug>/', DeleteFromCartView.as_view(), name='delete_from_cart'),
+    path('cart/update/', UpdateCartView.as_view(), name='update_cart'),
     path('change-qty/<str:slug>/', ChangeQTYView.as_view(), name='change_qty'),
     path('checkout/', CheckoutView.as_view(), name='checkout'),
     path('make-order/', MakeOrderView.as_view(), name='make_order'),
+    path('orders/', OrderHistoryView.as_view(), name='order_history'),
+    path('reports/orders.csv', OrderExportView.as_view(), name='order_export'),
+    path('perf/stats/', PerfStatsView.as_view(), name='perf_stats'),
+    path('api/categories/', CategoryListAPIView.as_view(), name='api_categories'),
+    path('api/products/', ProductListAPIView.as_view(), name='api_products'),
+    path('api/products/<str:slug>/', ProductDetailAPIView.as_view(), name='api_product_detail'),
+    path('api/cart/', CartAPIView.as_view(), name='api_cart'),
+    path('api/cart/batch/', CartAPIView.as_view(), {'action': 'batch'}, name='api_cart_batch'),
+    path('api/cart/<str:action>/<str:slug>/', CartAPIView.as_view(), name='api_cart_action'),
 ]
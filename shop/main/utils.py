@@ -1,13 +1,188 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+from django.utils import timezone
+
+from .models import Cart, CartProduct, Product
+
+
+CART_OPERATIONS = ('add', 'qty', 'remove')
+MAX_CART_OPERATIONS = 100
+
+
+class CartOperationError(Exception):
+    pass
 
 
 def recalc_cart(cart):
-    
-        cart_data = cart.products.aggregate(models.Sum('total_price'), models.Count('id'))
-        if cart_data.get('total_price__sum'):
-            cart.final_price = cart_data['total_price__sum']
+    """Full recompute of the cart totals from its lines; used to repair drift."""
+    cart_data = cart.related_products.aggregate(models.Sum('total_price'), models.Count('id'))
+    cart.final_price = cart_data['total_price__sum'] or Decimal('0')
+    cart.total_products = cart_data['id__count']
+    cart.save(update_fields=['final_price', 'total_products'])
+
+
+def verify_cart_totals(cart, repair=False):
+    cart_data = cart.related_products.aggregate(models.Sum('total_price'), models.Count('id'))
+    expected_price = cart_data['total_price__sum'] or Decimal('0')
+    valid = cart.final_price == expected_price and cart.total_products == cart_data['id__count']
+    if not valid and repair:
+        recalc_cart(cart)
+    return valid
+
+
+def shift_cart_totals(cart, lines=0, price=Decimal('0')):
+    """Apply a delta to the stored totals with a single atomic UPDATE."""
+    if not lines and not price:
+        return
+    Cart.objects.filter(pk=cart.pk).update(
+        total_products=models.F('total_products') + lines,
+        final_price=models.F('final_price') + price,
+        updated_at=timezone.now()
+    )
+    cart.total_products += lines
+    cart.final_price += price
+
+
+def with_current_price(product):
+    """``product`` priced from the primary; lookups may come from the product cache or a replica."""
+    product.price = Product.objects.using(DEFAULT_DB_ALIAS).values_list('price', flat=True).get(pk=product.pk)
+    return product
+
+
+@transaction.atomic
+def add_cart_product(cart, product):
+    product = with_current_price(product)
+    cart_product, created = CartProduct.objects.get_or_create(user=cart.owner, cart=cart, product=product)
+    if created:
+        shift_cart_totals(cart, lines=1, price=cart_product.total_price)
+    return cart_product, created
+
+
+@transaction.atomic
+def change_cart_product_qty(cart, product, qty):
+    cart_product = CartProduct.objects.select_for_update().get(cart=cart, product=product)
+    old_total = cart_product.total_price
+    cart_product.product = with_current_price(product)
+    cart_product.qty = qty
+    cart_product.save(update_fields=['qty', 'total_price'])
+    shift_cart_totals(cart, price=cart_product.total_price - old_total)
+    return cart_product
+
+
+@transaction.atomic
+def remove_cart_product(cart, product):
+    cart_product = CartProduct.objects.select_for_update().get(cart=cart, product=product)
+    cart_product.delete()
+    shift_cart_totals(cart, lines=-1, price=-cart_product.total_price)
+    return cart_product
+
+
+def cart_operation(op, slug, qty=None):
+    """Validated ``(op, slug, qty)``; ``add`` defaults to one item and ``remove`` takes no qty."""
+    if op not in CART_OPERATIONS:
+        raise CartOperationError(f'Unknown cart operation {op!r}')
+    if not slug or not isinstance(slug, str):
+        raise CartOperationError('Every operation needs a product slug')
+    if op == 'remove':
+        return op, slug, None
+    try:
+        qty = int(1 if qty in (None, '') and op == 'add' else qty)
+    except (TypeError, ValueError):
+        qty = 0
+    if qty < 1:
+        raise CartOperationError(f'qty for {slug} must be a positive integer')
+    return op, slug, qty
+
+
+@transaction.atomic
+def apply_cart_operations(cart, operations):
+    """
+    Apply a list of ``(op, slug, qty)`` in order as one change: a single
+    ``slug__in`` product lookup, the touched lines locked in one query,
+    bulk delete/update/insert of what actually changed and one totals
+    UPDATE. ``add`` leaves an existing line as it is, like
+    ``add_cart_product``. Any invalid operation raises
+    ``CartOperationError`` before anything is written. Returns the number
+    of lines written.
+    """
+    operations = [cart_operation(*operation) for operation in operations]
+    if len(operations) > MAX_CART_OPERATIONS:
+        raise CartOperationError(f'At most {MAX_CART_OPERATIONS} operations per request')
+    if not operations:
+        return 0
+    slugs = {slug for _, slug, _ in operations}
+    products = {product.slug: product for product in Product.objects.filter(slug__in=slugs).only('id', 'slug', 'price')}
+    missing = slugs - products.keys()
+    if missing:
+        raise CartOperationError(f'Unknown products: {", ".join(sorted(missing))}')
+
+    lines = {}
+    if cart.pk is not None:
+        lines = {
+            line.product_id: line
+            for line in CartProduct.objects.select_for_update().filter(
+                cart=cart, product_id__in=[product.id for product in products.values()]
+            ).only('id', 'product_id', 'qty', 'total_price')
+        }
+    # Fold the operations into the final qty per product (None: no line).
+    wanted = {product_id: line.qty for product_id, line in lines.items()}
+    for op, slug, qty in operations:
+        product_id = products[slug].id
+        if op == 'add':
+            if wanted.get(product_id) is None:
+                wanted[product_id] = qty
+        elif wanted.get(product_id) is None:
+            raise CartOperationError(f'{slug} is not in the cart')
         else:
-            cart.final_price = 0
-        cart.total_products = cart_data['id__count']
+            wanted[product_id] = qty if op == 'qty' else None
+
+    prices = {product.id: product.price for product in products.values()}
+    removed, changed, created = [], [], []
+    lines_delta, price_delta = 0, Decimal('0')
+    for product_id, qty in wanted.items():
+        line = lines.get(product_id)
+        if line is None and qty is not None:
+            line = CartProduct(user=cart.owner, cart=cart, product_id=product_id, qty=qty, total_price=qty * prices[product_id])
+            created.append(line)
+            lines_delta += 1
+            price_delta += line.total_price
+        elif line is not None and qty is None:
+            removed.append(line.id)
+            lines_delta -= 1
+            price_delta -= line.total_price
+        elif line is not None and qty != line.qty:
+            old_total = line.total_price
+            line.qty = qty
+            line.total_price = qty * prices[product_id]
+            changed.append(line)
+            price_delta += line.total_price - old_total
+
+    if created and cart.pk is None:
+        raise CartOperationError('Save the cart before adding products to it')
+    if removed:
+        CartProduct.objects.filter(id__in=removed).delete()
+    if changed:
+        CartProduct.objects.bulk_update(changed, ['qty', 'total_price'])
+    if created:
+        CartProduct.objects.bulk_create(created)
+    shift_cart_totals(cart, lines=lines_delta, price=price_delta)
+    return len(removed) + len(changed) + len(created)
+
+
+class CartContents:
+    """Cart lines loaded with their products in one query, for rendering."""
+
+    def __init__(self, cart):
+        self.cart = cart
+        if cart.pk is None:
+            self.items = []
+        else:
+            self.items = list(cart.related_products.select_related('product').order_by('id'))
+        self.count = len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
 
-        cart.save()
\ No newline at end of file
+    def __len__(self):
+        return self.count
@@ -1,30 +1,77 @@
-from django.db import transaction
+import uuid
+from urllib.parse import urlencode
+
+from django.db.models import prefetch_related_objects
 from django.shortcuts import render
+from django.urls import reverse
 from django.views.generic import DetailView, View
-from django.http import HttpResponseRedirect
-from django.contrib.contenttypes.models import ContentType
+from django.http import HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.views import redirect_to_login
+from django.utils.decorators import method_decorator
 from django.contrib import messages
 
-from .models import Category, Cart, Customer, CartProduct, Product
-from .mixins import CartMixin
-from .forms import OrderForm
-from .utils import recalc_cart
-
-
-class BaseView(CartMixin, View):
+from .models import Category, Order, Product
+from .mixins import AnonymousPageCacheMixin, CartMixin, ConditionalPageMixin
+from .checkout import CheckoutError, place_order
+from .facets import price_facets
+from .forms import CatalogFilterForm, OrderForm
+from .instrumentation import get_stats
+from .pagination import KeysetPaginator
+from .product_cache import get_product_or_404, product_cache
+from .reports import ORDER_EXPORT_FIELDS, iter_order_rows, stream_csv
+from .search import search_products
+from .sidebar import get_sidebar_categories
+from .utils import (
+    CartContents, CartOperationError, add_cart_product, apply_cart_operations, change_cart_product_qty,
+    remove_cart_product
+)
+
+
+PRODUCT_CARD_FIELDS = ('id', 'title', 'slug', 'image', 'has_derivatives', 'image_width', 'price', 'description')
+
+
+def category_listing_context(request, filter_form, page, facets):
+    filter_query = request.GET.copy()
+    for cursor in ('after', 'before'):
+        filter_query.pop(cursor, None)
+    sort = filter_query.get('sort', '')
+    for facet in facets:
+        facet['query'] = urlencode({
+            key: value for key, value in (
+                ('min_price', facet['min_price']), ('max_price', facet['max_price']), ('sort', sort)
+            ) if value not in (None, '')
+        })
+    return {
+        'category_products': page,
+        'page': page,
+        'filter_form': filter_form,
+        'filter_query': filter_query.urlencode(),
+        'price_facets': facets,
+    }
+
+
+class BaseView(AnonymousPageCacheMixin, CartMixin, View):
+
+    paginate_by = 24
+    carousel_size = 3
 
     def get(self, request, *args, **kwargs):
 
-        categories = Category.objects.all()
-        products = Product.objects.all()
+        categories = get_sidebar_categories()
+        carousel_products = Product.objects.only('id', 'image', 'has_derivatives', 'image_width').order_by('-id')[:self.carousel_size]
+        paginator = KeysetPaginator(Product.objects.only(*PRODUCT_CARD_FIELDS), self.paginate_by)
+        page = paginator.page_from_request(request)
         context = {
             'categories': categories,
-            'products': products,
+            'carousel_products': carousel_products,
+            'products': page,
+            'page': page,
             'cart': self.cart 
             }
         return render(request, 'index.html', context)
 
-class ProductDetailView(CartMixin, DetailView):
+class ProductDetailView(AnonymousPageCacheMixin, ConditionalPageMixin, CartMixin, DetailView):
 
     model = Product
     queryset = Product.objects.all()
@@ -32,70 +79,116 @@ class ProductDetailView(CartMixin, DetailView):
     template_name = 'product_detail.html'
     slug_url_kwargs = 'slug'
 
+    def get_page_last_modified(self, request, *args, **kwargs):
+        timestamps = Product.objects.filter(slug=kwargs.get('slug')).values_list(
+            'updated_at', 'category__updated_at'
+        ).first()
+        return max(timestamps) if timestamps else None
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['ct_model'] = self.model._meta.model_name
+        context['categories'] = get_sidebar_categories()
         context['cart'] = self.cart
         return context
 
-class CategoryDetailView(CartMixin, DetailView):
+class CategoryDetailView(AnonymousPageCacheMixin, ConditionalPageMixin, CartMixin, DetailView):
 
     model = Category
     queryset = Category.objects.all()
     context_object_name = 'category'
     template_name = 'category_detail.html'
     slug_url_kwargs = 'slug'
+    paginate_by = 24
+
+    def get_page_last_modified(self, request, *args, **kwargs):
+        timestamps = Category.objects.filter(slug=kwargs.get('slug')).values_list(
+            'updated_at', 'catalog_updated_at'
+        ).first()
+        return max(timestamps) if timestamps else None
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        filter_form = CatalogFilterForm(self.request.GET)
+        products = Product.objects.filter(category=self.object)
+        paginator = KeysetPaginator(
+            filter_form.filter_queryset(products).only(*PRODUCT_CARD_FIELDS),
+            self.paginate_by,
+            filter_form.get_ordering()
+        )
+        page = paginator.page_from_request(self.request)
+        context.update(category_listing_context(self.request, filter_form, page, price_facets(products)))
+        context['categories'] = get_sidebar_categories()
         context['cart'] = self.cart
         return context
 
+class SearchView(CartMixin, View):
+
+    paginate_by = 24
+
+    def get(self, request, *args, **kwargs):
+
+        query = request.GET.get('q', '').strip()
+        try:
+            page_number = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page_number = 1
+        products, has_next = [], False
+        if query:
+            products, has_next = search_products(
+                query, page_number, self.paginate_by, Product.objects.only(*PRODUCT_CARD_FIELDS)
+            )
+        context = {
+            'categories': get_sidebar_categories(),
+            'query': query,
+            'products': products,
+            'page_number': page_number,
+            'has_next': has_next,
+            'cart': self.cart
+            }
+        return render(request, 'search.html', context)
+
 class AddToCartView(CartMixin, View):
 
     def get(self, request, *args, **kwargs):
 
-        product_slug = kwargs.get('slug')
-        product = Product.objects.get(slug=product_slug)
-        cart_product, created = CartProduct.objects.get_or_create(user=self.cart.owner, cart=self.cart, product=product)
-        if created:
-            self.cart.products.add(cart_product)
-        recalc_cart(self.cart)
+        product = get_product_or_404(kwargs.get('slug'))
+        add_cart_product(self.get_or_create_cart(), product)
         # messages.add_message(request, messages.INFO, 'Goods adding well')
         return HttpResponseRedirect('/cart/')
 
 class DeleteFromCartView(CartMixin, View):
 
     def get(self, request, *args, **kwargs):
-        product_slug =  kwargs.get('slug')
-        product = Product.objects.get(slug=product_slug)
-        cart_product = CartProduct.objects.get(user=self.cart.owner, cart=self.cart, product=product)
-        self.cart.products.remove(cart_product)
-        cart_product.delete()
+        product = get_product_or_404(kwargs.get('slug'))
+        remove_cart_product(self.cart, product)
         messages.add_message(request, messages.INFO, 'Goods remove well')
-        recalc_cart(self.cart)
 
         return HttpResponseRedirect('/cart/')
 
 class ChangeQTYView(CartMixin, View):
 
     def post(self, request, *args, **kwargs):
-        product_slug = kwargs.get('slug')
-        product = Product.objects.get(slug=product_slug)
-        cart_product = CartProduct.objects.get(user=self.cart.owner, cart=self.cart, product=product)
+        product = get_product_or_404(kwargs.get('slug'))
         qty = int(request.POST.get('qty'))
+        change_cart_product_qty(self.cart, product, qty)
+        messages.add_message(request, messages.INFO, 'Count of goods edit well')
+        return HttpResponseRedirect('/cart/')
 
-        cart_qty = self.cart.total_products
-        cart_qty -= cart_product.qty
-        cart_qty += qty
-        self.cart.total_products = cart_qty
-        print(self.cart.total_products)
+class UpdateCartView(CartMixin, View):
+    """The cart page form: every line's ``qty-<slug>`` plus ``remove``/``add`` slugs, applied as one change."""
 
-        cart_product.qty = qty
-        cart_product.save()
-        recalc_cart(self.cart)
-        messages.add_message(request, messages.INFO, 'Count of goods edit well')
+    def post(self, request, *args, **kwargs):
+        operations = [('add', slug) for slug in request.POST.getlist('add')]
+        operations += [('qty', key[len('qty-'):], value) for key, value in request.POST.items() if key.startswith('qty-')]
+        operations += [('remove', slug) for slug in request.POST.getlist('remove')]
+        cart = self.get_or_create_cart() if request.POST.getlist('add') else self.cart
+        try:
+            apply_cart_operations(cart, operations)
+        except CartOperationError as e:
+            messages.add_message(request, messages.ERROR, str(e))
+        else:
+            messages.add_message(request, messages.INFO, 'Cart updated')
         return HttpResponseRedirect('/cart/')
 
 
@@ -103,50 +196,91 @@ class CartView(CartMixin, View):
 
     def get(self, request, *args, **kwargs):
 
-        categories = Category.objects.all()
+        categories = get_sidebar_categories()
         context = {
             'cart': self.cart,
+            'cart_contents': CartContents(self.cart),
             'categories': categories,
         }
         return render(request, 'cart.html', context)
 
+class CartBadgeView(CartMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        response = JsonResponse({'total_products': self.cart.total_products})
+        response['Cache-Control'] = 'private, no-store'
+        return response
+
 class CheckoutView(CartMixin, View):
 
     def get(self, request, *args, **kwargs):
 
-        categories = Category.objects.all()
-        form = OrderForm(request.POST or None)
+        categories = get_sidebar_categories()
+        form = OrderForm(request.POST or None, initial={'idempotency_key': uuid.uuid4().hex})
         context = {
             'categories': categories,
             'cart': self.cart,
+            'cart_contents': CartContents(self.cart),
             'form': form
             }
         return render(request, 'checkout.html', context)
 
 class MakeOrderView(CartMixin, View):
 
-    @transaction.atomic
     def post(self, request, *args, **kwargs):
 
+        if not request.user.is_authenticated:
+            return redirect_to_login(reverse('checkout'))
         form = OrderForm(request.POST or None)
-        customer = Customer.objects.get(user=request.user)
         if form.is_valid():
-            new_order = form.save(commit=False)
-            new_order.customer = customer
-            new_order.first_name = form.cleaned_data['first_name']
-            new_order.last_name = form.cleaned_data['last_name']
-            new_order.phone = form.cleaned_data['phone']
-            new_order.address = form.cleaned_data['address']
-            new_order.buying_type = form.cleaned_data['buying_type']
-            new_order.order_date = form.cleaned_data['order_date']
-            new_order.comment = form.cleaned_data['comment']
-            new_order.save()
-            self.cart.in_order = True
-            new_order.cart = self.cart
-            recalc_cart(self.cart)
-            new_order.save()
-            customer.orders.add(new_order)
+            # Customers are created lazily, e.g. for a cart carried over from an anonymous session.
+            customer = self.get_or_create_cart().owner
+            try:
+                place_order(self.cart, customer, form.save(commit=False), form.cleaned_data['idempotency_key'])
+            except CheckoutError as e:
+                messages.add_message(request, messages.ERROR, str(e))
+                return HttpResponseRedirect('/cart/')
             messages.add_message(request, messages.INFO, 'Thank you for order.')
 
             return HttpResponseRedirect('/')
         return HttpResponseRedirect('/checkout/')
+
+
+class OrderHistoryView(CartMixin, View):
+
+    paginate_by = 10
+
+    def get(self, request, *args, **kwargs):
+
+        if not request.user.is_authenticated:
+            return HttpResponseRedirect('/')
+        orders = Order.objects.filter(customer__user=request.user)
+        page = KeysetPaginator(orders, self.paginate_by, ordering=('-created_at', '-id')).page_from_request(request)
+        prefetch_related_objects(page.object_list, 'items')
+        context = {
+            'categories': get_sidebar_categories(),
+            'orders': page.object_list,
+            'page': page,
+            'cart': self.cart
+            }
+        return render(request, 'order_history.html', context)
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class OrderExportView(View):
+
+    chunk_size = 1000
+
+    def get(self, request, *args, **kwargs):
+        response = StreamingHttpResponse(
+            stream_csv(ORDER_EXPORT_FIELDS, iter_order_rows(self.chunk_size)), content_type='text/csv'
+        )
+        response['Content-Disposition'] = 'attachment; filename="orders.csv"'
+        return response
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class PerfStatsView(View):
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({'views': get_stats(), 'product_cache': product_cache.stats()})
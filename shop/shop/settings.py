@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -42,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.instrumentation.PerformanceMiddleware',
+    'main.db_router.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,9 +84,52 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # Local stand-in for a read replica; only read from when listed in DATABASE_REPLICAS.
+    # Fill it with `manage.py migrate --database replica` and `manage.py sync_replica`.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('SHOP_DB_REPLICA', BASE_DIR / 'db-replica.sqlite3'),
+    },
 }
 
+# Catalog reads go to these aliases (main.db_router); cart and order data always use the primary
+DATABASE_ROUTERS = ['main.db_router.ReplicaRouter']
+DATABASE_REPLICAS = ['replica'] if os.environ.get('SHOP_DB_REPLICA') else []
+DATABASE_REPLICA_MODELS = ['main.category', 'main.product']
+# Seconds catalog reads stay on the primary after a catalog write
+DATABASE_REPLICA_LAG = 5
+
+
+# Shared by every worker process, so catalog versions, page and product caches and invalidations
+# reach all of them: set SHOP_MEMCACHED (host:port) or SHOP_CACHE_DIR, a directory only the shop
+# user can write to. Without either the cache is per process, which only suits a single dev server.
+if os.environ.get('SHOP_MEMCACHED'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ['SHOP_MEMCACHED'],
+        }
+    }
+elif os.environ.get('SHOP_CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['SHOP_CACHE_DIR'],
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        }
+    }
+elif DEBUG:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    raise ImproperlyConfigured('Set SHOP_MEMCACHED or SHOP_CACHE_DIR so worker processes share a cache')
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -130,4 +178,24 @@ STATICFILES_DIRS = (
     # BASE_DIR.joinpath('static_dev'),
 )
 
-CRISPY_TEMPLATE_PACK = 'bootstrap4'
\ No newline at end of file
+CRISPY_TEMPLATE_PACK = 'bootstrap4'
+
+# Background jobs (main.jobs): 'thread', 'process' or None to only run them via `manage.py drain_jobs`.
+# The pool only makes each job's first attempt; retries, delayed and stale jobs need `manage.py drain_jobs --loop`.
+JOBS_EXECUTOR = 'thread'
+JOBS_WORKERS = 2
+JOBS_RETRY_DELAY = 30
+
+# Serve anonymous catalog pages from the cache (main.page_cache)
+PAGE_CACHE = True
+
+# Share of requests timed by main.instrumentation.PerformanceMiddleware
+PERF_SAMPLE_RATE = 0.1
+# Adds the sampled timings to responses as a Server-Timing header; visible to every client, so development only
+PERF_SERVER_TIMING = False
+
+# Runs the tests on a private locmem cache with PerformanceMiddleware sampling off
+TEST_RUNNER = 'main.test_runner.ShopTestRunner'
+
+# Serve the catalog and cart pages with the async views (main.async_views); shop/asgi.py turns this on
+ASYNC_STOREFRONT = os.environ.get('SHOP_ASYNC_STOREFRONT') == '1'